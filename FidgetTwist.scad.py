@@ -22,9 +22,8 @@ def koch_snowflake(R, pieces=6, iterations=3):
     return base
 
 def perimeter(shape, r, segments=6):
-    border = sd.circle(r=r, _fn=segments)
-    final = sd.minkowski()(shape, border)
-    final -= shape
+    final = svg.offset_outline(shape, r, segments=segments)
+    final -= svg.outline_polygon(shape)
     return final
 
 def ring(R, r, height, twist, slices, scale):
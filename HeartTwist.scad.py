@@ -21,10 +21,9 @@ def koch_snowflake(R, pieces=6, iterations=3):
     base = sd.rotate(30)(base)
     return base
 
-def perimeter(shape, r, segments=64):
-    border = sd.circle(r=r, _fn=segments)
-    final = sd.minkowski()(shape, border)
-    final -= shape
+def perimeter(shape, r, segments=64, fn=0):
+    final = svg.offset_outline(shape, r, segments=segments, fn=fn)
+    final -= svg.outline_polygon(shape, fn)
     return final
 
 def heart(R):
@@ -36,9 +35,9 @@ def heart(R):
     center = sd.translate([0,-R/8])(center)
     return center
 
-def ring(R, r, height, twist, slices, scale):
+def ring(R, r, height, twist, slices, scale, fn=0):
     koch = heart(R)
-    koch = perimeter(koch, r)
+    koch = perimeter(koch, r, fn=fn)
     graphic = sd.linear_extrude(height=10, twist=twist, slices=slices, scale=scale)(koch)
     graphic += sd.rotate([180,0,180])(graphic)
     return graphic
@@ -55,7 +54,7 @@ if __name__ == '__main__':
     # drops = itertools.accumulate(gaps)
 
     # final = sd.union()(*[ring(R-i*gap, 1.2, height=10, twist=twist, slices=slices, scale=scale) for i in range(8)])
-    final = sd.union()(*[ring(R-drop, 1.2, height=10, twist=twist, slices=slices, scale=scale) for drop in drops])
+    final = sd.union()(*[ring(R-drop, 1.2, height=10, twist=twist, slices=slices, scale=scale, fn=fn) for drop in drops])
     final = sd.scad_render(final, file_header=f'$fn={fn};')
     print(final)
 
@@ -12,9 +12,8 @@ import itertools
 
 
 def perimeter(shape, r, segments=64):
-    border = sd.circle(r=r, _fn=segments)
-    final = sd.minkowski()(shape, border)
-    final -= shape
+    final = svg.offset_outline(shape, r, segments=segments)
+    final -= svg.outline_polygon(shape)
     return final
 
 def cross(R):
@@ -33,8 +32,8 @@ def cross_perimeter(R, r, pushout, wall=.8):
     cross = sd.square([R, r], center=True)
     cross += sd.rotate([0,0,90])(cross)
     if pushout > 0:
-        cross = sd.minkowski()(cross, sd.square(pushout, center=True))
-    outer = sd.minkowski()(cross, sd.square(2*wall, center=True))
+        cross = svg.offset_outline(cross, pushout/2, 'miter')
+    outer = svg.offset_outline(cross, wall, 'miter')
     outer -= cross
     return outer
     # Minkowski sum of square with cross
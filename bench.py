@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+'''Benchmarks over the models in this repository.
+Each case builds a model at a few sizes and times every stage separately:
+tree build, scad_render, OpenSCAD, SVG parse and serialize (the last two
+for 2D models only). Python peak memory is measured with tracemalloc in a
+separate run and OpenSCAD's from the resident size of each OpenSCAD process.
+
+Results are appended to a JSON history file and compared with a baseline
+run; stages that got slower than the threshold are reported as regressions
+and make the exit status non-zero.
+
+    ./bench.py                      # run everything, compare with the baseline
+    ./bench.py koch yinyang --quick # a couple of cases at their smallest size
+    ./bench.py --set-baseline       # record this run as the new baseline
+'''
+
+import argparse
+import io
+import itertools
+import json
+import pathlib
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import solid2 as sd
+import svgSCAD as svg
+
+HERE = pathlib.Path(__file__).resolve().parent
+
+def load_script(name):
+    return svg.load_script(HERE / name)
+
+# Cases: name -> (dimension, {size label: builder}). A builder returns a list of
+# layers (solid2 objects) and the $fn to render them with.
+
+def koch_cases():
+    koch = load_script('HeartTwist.scad.py').koch_snowflake
+    return {f'iterations={n}':lambda n=n: ([koch(50, iterations=n)], 64) for n in (1, 2, 3)}
+
+def nested_koch_cases():
+    # Layout of examples/NestedKoch.svg.py, which itself uses the legacy solid package.
+    koch_snowflake = load_script('HeartTwist.scad.py').koch_snowflake
+    def build(iterations):
+        R = 50
+        scale = 1/np.sqrt(3)
+        koch = koch_snowflake(R, iterations=iterations)
+        ring = sd.scale(scale)(koch)
+        ring = sd.rotate([0,0,30])(ring)
+        ring = sd.translate([2/np.sqrt(3)*R,0,0])(ring)
+        ring = sd.union()(*[sd.rotate([0,0,i*60])(ring) for i in range(6)])
+        ring2 = sd.rotate([0,0,30])(sd.scale(scale)(ring))
+        ring3 = sd.rotate([0,0,30])(sd.scale(scale)(ring2))
+        return [koch, ring, ring2, ring3], 256
+    return {f'iterations={n}':lambda n=n: build(n) for n in (2, 3)}
+
+def yinyang_cases():
+    # Same construction as examples/YinYang.svg.py.
+    def build(fn):
+        R = 50
+        image = sd.circle(r=R)
+        image -= svg.halfPlane('L')
+        image += sd.translate([0,R/2])(sd.circle(R/2))
+        image -= sd.translate([0,-R/2])(sd.circle(R/2))
+        image -= sd.translate([0,R/2])(sd.circle(R/6))
+        image += sd.translate([0,-R/2])(sd.circle(R/6))
+        image += svg.annulus(R, R/20, 'outer')
+        image2 = sd.translate([50,-50])(image)
+        return [image, image2], fn
+    return {f'fn={fn}':lambda fn=fn: build(fn) for fn in (64, 256, 1024)}
+
+def heart_twist_cases():
+    ring = load_script('HeartTwist.scad.py').ring
+    def build(rings, fn):
+        drops = itertools.accumulate([8,7.5,7,6.5,6,5.5,5,4.5,4][:rings-1], initial=0)
+        final = sd.union()(*[ring(62-drop, 1.2, height=10, twist=15, slices=50, scale=.8, fn=fn) for drop in drops])
+        return [final], fn
+    return {f'rings={n},fn={fn}':lambda n=n, fn=fn: build(n, fn) for n, fn in ((1, 16), (1, 45), (3, 45))}
+
+def perimeter_shapes():
+    heart = load_script('HeartTwist.scad.py').heart
+    cross = load_script('RectTwist.scad.py').cross
+    return {'heart':heart(62), 'cross':cross(50)}
+
+def perimeter_minkowski_cases():
+    # The minkowski-with-circle perimeters that offset_outline replaced.
+    def build(shape, fn):
+        return [sd.minkowski()(shape, sd.circle(r=1.2, _fn=64)) - shape], fn
+    return {f'{name},fn={fn}':lambda shape=shape, fn=fn: build(shape, fn) for name, shape in perimeter_shapes().items() for fn in (45, 128)}
+
+def perimeter_offset_cases():
+    def build(shape, fn):
+        return [svg.offset_outline(shape, 1.2, segments=64, fn=fn) - svg.outline_polygon(shape, fn)], fn
+    return {f'{name},fn={fn}':lambda shape=shape, fn=fn: build(shape, fn) for name, shape in perimeter_shapes().items() for fn in (45, 128)}
+
+def radiant_cases():
+    radiant = load_script('Radiant.scad.py')
+    tgd = radiant.tgd
+    def build(unit):
+        R = 50
+        v = tgd.cuboctahedron(2*unit)
+        vx = [list(np.array(y)*R) for y in [[0,1,1],[0,1,-1],[0,-1,-1],[0,-1,1]]]
+        vy = [list(np.array(y)*R) for y in [[1,0,1],[1,0,-1],[-1,0,-1],[-1,0,1]]]
+        final = radiant.sd.union()(*radiant.path(v, [vx[2],vy[1],vx[1],vy[2]]))
+        return [final], 64
+    return {f'unit={unit}':lambda unit=unit: build(unit) for unit in (3,)}
+
+def cuboct_puzzle_cases():
+    # Same layout as CubOctPuzzle.scad.py.
+    tgd = load_script('tgd_shapes.py')
+    def build(unit):
+        v = tgd.cuboctahedron(unit)
+        pieces = [
+            [[0,0,0], [-unit,0,0], [unit,0,0], [0,unit,0], [0,unit,unit]],
+            [[0,0,0], [-unit,0,0], [unit,0,0], [0,unit,0], ],
+            [[0,0,0], [-unit,0,0], [unit,0,0], [-unit,unit,0], ],
+            [[0,0,0], [-unit,unit,0], [unit,0,0], [0,unit,0], [0,unit,unit]],
+            [[0,0,0], [-unit,unit,0], [unit,unit,0], [0,unit,0], [-unit,unit,unit]],
+            [[0,0,0], [unit,0,0], [0,unit,0], [0,unit,unit]],
+            ]
+        pieces = [sd.union()(*[sd.translate(p)(v) for p in piece]) for piece in pieces]
+        final = pieces[0]
+        final += sd.translate([3*unit,unit,0])(sd.rotate([0,0,180])(pieces[1]))
+        final += sd.translate([-3*unit,unit,0])(sd.rotate([180,0,0])(pieces[2]))
+        final += sd.translate([-3*unit,3*unit,0])(pieces[3])
+        final += sd.translate([0,3*unit,0])(pieces[4])
+        final += sd.translate([3*unit,3*unit,0])(pieces[5])
+        return [final], 64
+    return {f'unit={unit}':lambda unit=unit: build(unit) for unit in (10, 20)}
+
+def polyhedra_cases():
+    tgd = load_script('tgd_shapes.py')
+    shapes = {
+        'cuboctahedron':tgd.cuboctahedron,
+        'truncated_cuboctahedron':tgd.truncated_cuboctahedron,
+        'rhombicosidodecahedron':tgd.rhombicosidodecahedron,
+        }
+    return {name:lambda shape=shape: ([shape(50)], 64) for name, shape in shapes.items()}
+
+CASES = {
+    'koch':('2D', koch_cases),
+    'nested_koch':('2D', nested_koch_cases),
+    'yinyang':('2D', yinyang_cases),
+    'perimeter_minkowski':('2D', perimeter_minkowski_cases),
+    'perimeter_offset':('2D', perimeter_offset_cases),
+    'heart_twist':('3D', heart_twist_cases),
+    'radiant':('3D', radiant_cases),
+    'cuboct_puzzle':('3D', cuboct_puzzle_cases),
+    'polyhedra':('3D', polyhedra_cases),
+    }
+
+class Stage:
+    '''Time one stage: wall and CPU seconds, or with trace Python peak memory.
+    tracemalloc slows Python down several times over, so a traced run's
+    timings are only good for telling where the memory went.
+    '''
+    def __init__(self, results, name, trace=False):
+        self.results = results
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.start()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        peak = 0
+        if self.trace:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        stage = self.results.setdefault(self.name, {'wall':0.0, 'cpu':0.0, 'peak_bytes':0})
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+        stage['peak_bytes'] = max(stage['peak_bytes'], peak)
+
+def run_case(dimension, builder, use_openscad, trace=False):
+    results = {}
+    with Stage(results, 'build', trace):
+        layers, fn = builder()
+    with Stage(results, 'scad_render', trace):
+        texts = [svg.scad_text(layer, fn) for layer in layers]
+    results['scad_render']['bytes'] = sum(len(text) for text in texts)
+    if not use_openscad:
+        return results
+    outputs = []
+    with svg.recording() as events, Stage(results, 'openscad', trace):
+        for text in texts:
+            outputs.append(svg.openscad_export(text, 'svg' if dimension == '2D' else 'asciistl'))
+    results['openscad']['bytes'] = sum(len(output) for output in outputs)
+    # Measured per OpenSCAD process, so every case reports its own peak.
+    usage = svg.summarize(events).get('openscad', {})
+    results['openscad']['child_cpu'] = usage.get('child_cpu', 0.0)
+    results['openscad']['child_maxrss_kb'] = usage.get('child_maxrss_kb', 0)
+    if dimension == '2D':
+        with Stage(results, 'parse', trace):
+            docs = [svg.scadSVG(None, fn, str_svg=output) for output in outputs]
+        doc = docs[0]
+        for other in docs[1:]:
+            doc += other
+        with Stage(results, 'serialize', trace):
+            doc.write(io.StringIO())
+        results['parse']['vertices'] = sum(len(layer.geometry.coords) for layer in doc.layers)
+    return results
+
+def best_of(runs):
+    '''Per stage, keep the fastest repetition.'''
+    best = {}
+    for run in runs:
+        for stage, values in run.items():
+            if stage not in best or values['wall'] < best[stage]['wall']:
+                best[stage] = values
+    return best
+
+def git_revision():
+    try:
+        p = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=HERE)
+    except OSError:
+        return None
+    return p.stdout.strip() or None
+
+def compare(results, baseline, threshold, floor):
+    '''Stages slower than baseline by more than threshold (and by more than floor seconds).'''
+    regressions = []
+    for case, sizes in results.items():
+        for size, stages in sizes.items():
+            for stage, values in stages.items():
+                old = baseline.get(case, {}).get(size, {}).get(stage)
+                if old is None:
+                    continue
+                if values['wall'] > old['wall'] * (1 + threshold) and values['wall'] - old['wall'] > floor:
+                    regressions.append((case, size, stage, old['wall'], values['wall']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', metavar='case', help=f'cases to run (default: all of {", ".join(CASES)})')
+    parser.add_argument('--quick', action='store_true', help='only the smallest size of each case')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per size, best is kept')
+    parser.add_argument('--history', default=HERE / 'bench_history.json', type=pathlib.Path)
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    parser.add_argument('--floor', type=float, default=0.005, help='ignore slowdowns under this many seconds')
+    parser.add_argument('--set-baseline', action='store_true', help='mark this run as the baseline')
+    parser.add_argument('--no-openscad', action='store_true', help='skip stages that need OpenSCAD')
+    args = parser.parse_args(argv)
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f'unknown cases: {", ".join(sorted(unknown))}')
+
+    use_openscad = not args.no_openscad and shutil.which('openscad') is not None
+    if not use_openscad:
+        print('OpenSCAD stages skipped', file=sys.stderr)
+    # The cache would hide OpenSCAD's own time.
+    svg.render_cache = None
+
+    results = {}
+    for case in args.cases or CASES:
+        dimension, make_builders = CASES[case]
+        try:
+            builders = make_builders()
+        except ImportError as e:
+            print(f'{case}: skipped ({e})', file=sys.stderr)
+            continue
+        if args.quick:
+            builders = dict(itertools.islice(builders.items(), 1))
+        for size, builder in builders.items():
+            runs = [run_case(dimension, builder, use_openscad) for _ in range(args.repeat)]
+            results.setdefault(case, {})[size] = best = best_of(runs)
+            # Memory gets a run of its own so tracing does not skew the timings.
+            traced = run_case(dimension, builder, use_openscad, trace=True)
+            for stage, values in best.items():
+                values['peak_bytes'] = traced.get(stage, {}).get('peak_bytes', 0)
+            timings = '  '.join(f'{stage} {values["wall"]*1000:.1f}ms' for stage, values in best.items())
+            print(f'{case:14} {size:18} {timings}')
+
+    history = json.loads(args.history.read_text()) if args.history.exists() else []
+    baseline = next((run for run in reversed(history) if run.get('baseline')), None)
+    run = {
+        'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision':git_revision(),
+        'python':platform.python_version(),
+        'openscad':svg.openscad_version() if use_openscad else None,
+        'baseline':args.set_baseline,
+        'results':results,
+        }
+    history.append(run)
+    args.history.write_text(json.dumps(history, indent=1))
+
+    if baseline is None or args.set_baseline:
+        return 0
+    regressions = compare(results, baseline['results'], args.threshold, args.floor)
+    for case, size, stage, old, new in regressions:
+        print(f'REGRESSION {case} {size} {stage}: {old*1000:.1f}ms -> {new*1000:.1f}ms', file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
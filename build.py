@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+'''Incremental build of every model script in the repository.
+Each *.scad.py and *.svg.py script (here and in examples/) prints its model;
+the output goes next to it with the .py dropped, e.g. HeartTwist.scad.py
+writes HeartTwist.scad. A script is rebuilt only when its output is missing
+or the hash of its source, the local modules it imports (followed
+recursively), the SVGSCAD_* settings and the OpenSCAD version changed.
+Stale scripts run in parallel.
+
+    ./build.py                 # rebuild whatever is stale
+    ./build.py -j 8 examples/  # only scripts under examples/, 8 at a time
+    ./build.py --dry-run       # list what would be rebuilt
+'''
+
+import argparse
+import ast
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import svgSCAD as svg
+
+HERE = pathlib.Path(__file__).resolve().parent
+STATE_FILE = HERE / '.build_state.json'
+PATTERNS = ('*.scad.py', '*.svg.py')
+
+def find_scripts(roots):
+    '''Model scripts in the given files and directories.'''
+    scripts = []
+    for root in roots:
+        root = pathlib.Path(root)
+        if root.is_dir():
+            for pattern in PATTERNS:
+                scripts += root.glob(pattern)
+        else:
+            scripts.append(root)
+    return sorted(set(path.absolute() for path in scripts))
+
+def imported_names(path):
+    '''Top-level module names a Python file imports, wherever the import statement is.
+    >>> sorted(imported_names(pathlib.Path(__file__)))[:3]
+    ['argparse', 'ast', 'concurrent']
+    '''
+    tree = ast.parse(path.read_text(), str(path))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return names
+
+def local_dependencies(script):
+    '''Local modules script imports, directly or through each other.
+    Modules are looked up next to the importing file, as Python does for a script.
+    '''
+    found = {}
+    stack = [script]
+    while stack:
+        path = stack.pop()
+        for name in imported_names(path):
+            candidate = path.parent / f'{name}.py'
+            if candidate.exists() and candidate not in found:
+                found[candidate] = True
+                stack.append(candidate)
+    found.pop(script, None)
+    return sorted(found)
+
+def output_path(script):
+    return script.with_name(script.name[:-len('.py')])
+
+def build_hash(script, dependencies, settings):
+    digest = hashlib.sha256()
+    for path in [script, *dependencies]:
+        digest.update(path.name.encode() + b'\0')
+        # Symlinked copies such as examples/svgSCAD.py hash as their target.
+        digest.update(path.resolve().read_bytes() + b'\0')
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def run_script(script):
+    '''Run one script and atomically replace its output with what it prints.'''
+    output = output_path(script)
+    start = time.perf_counter()
+    partial = output.with_name(f'.{output.name}.partial')
+    with open(partial, 'w') as fp:
+        p = subprocess.run([sys.executable, script.name], stdout=fp, stderr=subprocess.PIPE, text=True, cwd=script.parent)
+    if p.returncode != 0:
+        partial.unlink()
+        return time.perf_counter() - start, p.stderr.strip().splitlines()[-1:] or [f'exit code {p.returncode}']
+    os.replace(partial, output)
+    return time.perf_counter() - start, None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('targets', nargs='*', type=pathlib.Path, help='scripts or directories (default: the repository and examples/)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='scripts to run at once')
+    parser.add_argument('--force', action='store_true', help='rebuild even when up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only list the stale scripts')
+    args = parser.parse_args(argv)
+
+    scripts = find_scripts(args.targets or [HERE, HERE / 'examples'])
+    settings = {name:value for name, value in os.environ.items() if name.startswith('SVGSCAD_')}
+    settings['openscad'] = svg.openscad_version()
+    state = json.loads(STATE_FILE.read_text()) if STATE_FILE.exists() else {}
+
+    stale = {}
+    for script in scripts:
+        key = str(output_path(script).relative_to(HERE)) if script.is_relative_to(HERE) else str(output_path(script))
+        digest = build_hash(script, local_dependencies(script), settings)
+        if args.force or state.get(key) != digest or not output_path(script).exists():
+            stale[script] = (key, digest)
+    print(f'{len(stale)} of {len(scripts)} scripts out of date')
+    if args.dry_run:
+        for script in stale:
+            print(f'  {script.relative_to(HERE) if script.is_relative_to(HERE) else script}')
+        return 0
+
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {pool.submit(run_script, script):script for script in stale}
+        for future in concurrent.futures.as_completed(futures):
+            key, digest = stale[futures[future]]
+            wall, error = future.result()
+            if error:
+                failed += 1
+                print(f'FAILED {key} ({wall:.1f}s): {error[0]}')
+                state.pop(key, None)
+            else:
+                print(f'built  {key} ({wall:.1f}s)')
+                state[key] = digest
+            # Saved after every script so an interrupted build keeps its progress.
+            STATE_FILE.write_text(json.dumps(state, indent=1, sort_keys=True))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,7 +23,7 @@ if __name__ == '__main__':
     R = 50
     scale = 1/np.sqrt(3)
 
-    koch = koch_snowflake(R, iterations=3)
+    koch = koch_snowflake(R, iterations=svg.detail(3, 1))
     ring = sd.scale(scale)(koch)
     ring = sd.rotate([0,0,30])(ring)
     ring = sd.translate([2/np.sqrt(3)*R,0,0])(ring)
@@ -32,10 +32,12 @@ if __name__ == '__main__':
     ring2 = sd.rotate([0,0,30])(ring2)
     ring3 = sd.scale(scale)(ring2)
     ring3 = sd.rotate([0,0,30])(ring3)
-    graphic = svg.scadSVG(koch, fill='blue',strokewidth=.01)
-    graphic += svg.scadSVG(ring, fill='blue',strokewidth=.01)
-    graphic += svg.scadSVG(ring2, fill='red',strokewidth=.01)
-    graphic += svg.scadSVG(ring3, fill='yellow',strokewidth=.01)
+    layers = svg.scadSVG_many([koch, ring, ring2, ring3], strokewidth=.01)
+    for layer, fill in zip(layers, ['blue', 'blue', 'red', 'yellow']):
+        layer.set_scadSVG_path_attrs(0, fill=fill)
+    graphic = layers[0]
+    for layer in layers[1:]:
+        graphic += layer
     print(graphic)
 
 
@@ -4,6 +4,7 @@
 Uses svgSCAD package.
 '''
 
+import sys
 import solid as sd
 import svgSCAD as svg
 
@@ -21,4 +22,9 @@ if __name__ == '__main__':
     image += svg.annulus(R, R/20, 'outer')
     image2 = sd.translate([50,-50])(image)
 
-    print(svg.scadSVG(image, fn=fn, fill='blue')+svg.scadSVG(image2, fn=fn, fill='lightgreen'))
+    layers = {
+        'yinyang':(image, {'fill':'blue'}),
+        'yinyang2':(image2, {'fill':'lightgreen'}),
+        }
+    document, _ = svg.render_layers(layers, fn=fn)
+    document.write(sys.stdout)
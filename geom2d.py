@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+'''In-process evaluation of 2D solid2 trees.
+Walks circle/square/polygon, the affine transforms, union/difference/
+intersection/hull, minkowski with convex shapes and offset(delta), with
+shapely as the polygon clipping engine, so simple 2D work never starts
+OpenSCAD. Subtrees with any other node are rendered by OpenSCAD and
+their outlines are brought back in.
+
+Use it for a single document with scadSVG(obj, backend=geom2d.backend) or
+for everything with svgSCAD.default_backend = geom2d.backend.
+'''
+
+import numpy as np
+import solid2 as sd
+import svgSCAD as svg
+try:
+    import shapely
+    import shapely.affinity
+    import shapely.geometry
+    import shapely.geometry.polygon
+except ImportError:
+    shapely = None
+
+GRID_FINE = 0.00000095367431640625
+
+class Unsupported(Exception):
+    '''Node that the in-process evaluator cannot handle.'''
+
+def fragments(r, fn=0, fa=12, fs=2):
+    '''Number of segments OpenSCAD uses for a circle of radius r.
+    >>> fragments(10, 0), fragments(10, 64), fragments(100, 0)
+    (30, 64, 30)
+    '''
+    if r < GRID_FINE:
+        return 3
+    if fn > 0:
+        return int(fn if fn >= 3 else 3)
+    return int(np.ceil(max(min(360 / fa, r*2*np.pi / fs), 5)))
+
+def circle_points(r, n):
+    '''Vertices of OpenSCAD's circle(r) with n fragments, starting on the x-axis.'''
+    phi = 2*np.pi*np.arange(n)/n
+    return np.column_stack([r*np.cos(phi), r*np.sin(phi)])
+
+def _vector(v, size=2, fill=0):
+    if np.isscalar(v):
+        return [v] * size
+    v = list(v) + [fill] * (size - len(v))
+    return v
+
+def _plain(value):
+    '''Whether a parameter value is data, rather than an OpenSCAD expression such as scad_inline.'''
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'biuf'
+    if isinstance(value, (list, tuple)):
+        return all(_plain(item) for item in value)
+    return value is None or isinstance(value, (bool, int, float, str, np.number))
+
+def _matrix(node):
+    '''3x3 affine matrix of a transform node that stays in the xy-plane.'''
+    m = svg.affine_matrix(node)
+    if np.any(np.abs(m[:2, 2]) > 1e-12) or np.any(np.abs(m[2, :2]) > 1e-12):
+        raise Unsupported(f'{node._name} out of the xy-plane')
+    return m[np.ix_([0, 1, 3], [0, 1, 3])]
+
+AFFINE = svg.AFFINE_NODES
+PASS_THROUGH = ('union', 'color', 'render', 'group')
+
+def transform(geometry, m):
+    return shapely.affinity.affine_transform(geometry, [m[0, 0], m[0, 1], m[1, 0], m[1, 1], m[0, 2], m[1, 2]])
+
+def from_loops(loops):
+    '''Shapely geometry from outlines, filled by the even-odd rule like OpenSCAD polygons.'''
+    geometry = shapely.geometry.Polygon()
+    for loop in loops:
+        if len(loop) >= 3:
+            geometry = geometry.symmetric_difference(shapely.geometry.Polygon(loop).buffer(0))
+    return geometry
+
+def minkowski(geometry, kernel):
+    '''Minkowski sum of shapely geometry with a convex polygon given by its vertices.
+    That is the geometry moved by one kernel vertex, together with every edge
+    (holes included) swept by the kernel, the hull of the kernel at both ends.
+    >>> round(minkowski(shapely.geometry.box(0, 0, 2, 2), [[-1, -1], [1, -1], [1, 1], [-1, 1]]).area, 6)
+    16.0
+    '''
+    kernel = np.asarray(kernel, float).reshape(-1, 2)
+    edges = [np.stack([loop, np.roll(loop, -1, axis=0)], axis=1) for loop in loops(geometry)]
+    if not edges:
+        return geometry
+    edges = np.concatenate(edges)
+    swept = (edges[:, :, None, :] + kernel[None, None]).reshape(len(edges), -1, 2)
+    hulls = shapely.convex_hull(shapely.multipoints(swept))
+    moved = shapely.affinity.translate(geometry, *kernel[0])
+    # Zero tolerance only drops the collinear vertices left where the pieces met.
+    return shapely.union_all([moved, *hulls]).simplify(0)
+
+def convex_vertices(geometry):
+    '''Vertices of geometry if it is a single convex polygon, else None.'''
+    if geometry.geom_type != 'Polygon' or geometry.is_empty or geometry.interiors:
+        return None
+    hull = geometry.convex_hull
+    if abs(hull.area - geometry.area) > 1e-9 * max(hull.area, 1):
+        return None
+    return np.asarray(geometry.exterior.coords)[:-1]
+
+class Evaluator:
+    '''Evaluate a solid2 tree to shapely geometry.
+    Results are memoized per node so subtrees shared by fractal builders are only
+    evaluated once. When fallback is true, unsupported subtrees are rendered by
+    OpenSCAD instead of raising Unsupported.
+    '''
+    def __init__(self, fn=0, fa=12, fs=2, fallback=True):
+        self.special = (fn, fa, fs)
+        self.fallback = fallback
+        self.memo = {}
+        self.fallbacks = 0
+
+    def __call__(self, node, special=None):
+        special = special or self.special
+        key = (id(node), special)
+        if key not in self.memo:
+            self.memo[key] = (node, self._evaluate(node, special))
+        return self.memo[key][1]
+
+    def _children(self, node, special):
+        children = [self(child, special) for child in node._children]
+        return shapely.union_all(children) if children else shapely.geometry.Polygon()
+
+    def _evaluate(self, node, special):
+        try:
+            return self._node(node, special)
+        except Unsupported:
+            if not self.fallback:
+                raise
+        self.fallbacks += 1
+        info = svg.parse_svg(svg.scad2svg(node, special[0]))
+        loops = [loop * [1, -1] for path in info['paths'] for loop in path['geometry']]
+        return from_loops(loops)
+
+    def _node(self, node, special):
+        name = getattr(node, '_name', None)
+        params = getattr(node, '_params', {})
+        if not all(_plain(value) for value in params.values()):
+            raise Unsupported(f'{name} with OpenSCAD expressions')
+        fn, fa, fs = special
+        special = (
+            params.get('_fn') or fn,
+            params.get('_fa') or fa,
+            params.get('_fs') or fs,
+            )
+        if name == 'circle':
+            r = svg._circle_radius(node)
+            return shapely.geometry.Polygon(circle_points(r, fragments(r, *special)))
+        if name == 'square':
+            # square() without a size is 1 unit, as in OpenSCAD.
+            x, y = _vector(params['size'] if params.get('size') is not None else 1)
+            box = shapely.geometry.box(0, 0, x, y)
+            return shapely.affinity.translate(box, -x/2, -y/2) if params.get('center') else box
+        if name == 'polygon':
+            points = np.array(params['points'], float)
+            paths = params.get('paths') or [range(len(points))]
+            return from_loops([points[list(path)] for path in paths])
+        if name in AFFINE:
+            return transform(self._children(node, special), _matrix(node))
+        if name in PASS_THROUGH:
+            return self._children(node, special)
+        if name in ('difference', 'intersection', 'minkowski') and not node._children:
+            return shapely.geometry.Polygon()
+        if name == 'difference':
+            first, *rest = [self(child, special) for child in node._children]
+            return first.difference(shapely.union_all(rest)) if rest else first
+        if name == 'intersection':
+            first, *rest = [self(child, special) for child in node._children]
+            for other in rest:
+                first = first.intersection(other)
+            return first
+        if name == 'hull':
+            return self._children(node, special).convex_hull
+        if name == 'minkowski':
+            first, *rest = [self(child, special) for child in node._children]
+            for other in rest:
+                kernel = convex_vertices(other)
+                if kernel is None:
+                    raise Unsupported('minkowski with a concave shape')
+                first = minkowski(first, kernel)
+            return first
+        if name == 'offset' and params.get('r') is None and not params.get('chamfer'):
+            # OpenSCAD's delta offset is a mitre join with a limit too large to matter.
+            return self._children(node, special).buffer(params.get('delta') or 0, join_style='mitre', mitre_limit=1e6)
+        raise Unsupported(name)
+
+def evaluate(scad_obj, fn=0, fallback=True):
+    '''Shapely geometry for a 2D solid2 tree.
+    >>> import solid2 as sd
+    >>> round(evaluate(sd.square(4, center=True) - sd.square(2)).area, 6)
+    12.0
+    >>> evaluate(sd.difference()()).is_empty
+    True
+    >>> try:
+    ...     evaluate(sd.translate([sd.scad_inline('x'), 0])(sd.square(1)), fallback=False)
+    ... except Unsupported as e:
+    ...     print(e)
+    translate with OpenSCAD expressions
+    '''
+    return Evaluator(fn, fallback=fallback)(scad_obj)
+
+def loops(geometry):
+    '''Outlines of shapely geometry: outer boundaries counterclockwise, holes clockwise.'''
+    if hasattr(geometry, 'geoms'):
+        for part in geometry.geoms:
+            yield from loops(part)
+    elif geometry.geom_type == 'Polygon' and not geometry.is_empty:
+        polygon = shapely.geometry.polygon.orient(geometry, 1.0)
+        for ring in [polygon.exterior, *polygon.interiors]:
+            yield np.asarray(ring.coords)[:-1]
+
+def to_scad(geometry):
+    '''One solid2 polygon with every outline of shapely geometry as a path.'''
+    points, paths, start = [], [], 0
+    for outline in loops(geometry):
+        points += outline.tolist()
+        paths.append(list(range(start, start + len(outline))))
+        start += len(outline)
+    return sd.polygon(points, paths)
+
+def svg_info(geometry):
+    '''parse_svg style description of shapely geometry, laid out as OpenSCAD exports it:
+    y pointing down and a whole-millimetre viewBox.
+    '''
+    outlines = [loop * [1, -1] for loop in loops(geometry)]
+    if outlines:
+        xmin, ymin, xmax, ymax = svg.PathGeometry.from_subpaths(outlines).bounds()
+    else:
+        xmin = ymin = xmax = ymax = 0
+    minx, miny = int(np.floor(xmin)), int(np.floor(ymin))
+    width, height = int(np.ceil(xmax)) - minx, int(np.ceil(ymax)) - miny
+    return {
+        'viewBox':(minx, miny, width, height),
+        'width':(width, 'mm'),
+        'height':(height, 'mm'),
+        'paths':[{
+            'geometry':svg.PathGeometry.from_subpaths(outlines),
+            'attrs':{'stroke':'black', 'fill':'lightgray', 'stroke-width':'0.5'},
+            }],
+        }
+
+def backend(scad_obj, fn):
+    '''scadSVG backend that evaluates in-process, using OpenSCAD only where it has to.'''
+    if shapely is None:
+        return svg.openscad_backend(scad_obj, fn)
+    return svg_info(evaluate(scad_obj, fn))
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+'''Iterated function system (IFS) fractals computed with NumPy.
+koch_snowflake, starfish and inverseSierpinskiGasket all grow a shape by
+adding scaled, shifted and rotated copies of everything built so far. Here
+the copies are 3x3 affine matrices, and every instance of every level
+comes out of one batched matrix product instead of a SCAD tree that
+doubles in size with each iteration.
+
+Koch snowflake of svgSCAD.hexagram(R), as built in NestedKoch.svg.py:
+
+    step = ifs.compose(ifs.translate((1-1/3)*R, 0), ifs.scale(1/3))
+    polys = ifs.instances(ifs.hexagram(R), ifs.spread(step, 6), depth=5)
+    graphic = ifs.scadSVG(polys, fill='blue')
+
+For deep accumulated fractals ifs.merged(base, maps, depth) produces the
+same outline much faster by merging level by level.
+'''
+
+import numpy as np
+import solid2 as sd
+import svgSCAD as svg
+import geom2d
+
+def translate(x, y):
+    return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], float)
+
+def scale(sx, sy=None):
+    sy = sx if sy is None else sy
+    return np.array([[sx, 0, 0], [0, sy, 0], [0, 0, 1]], float)
+
+def rotate(degrees):
+    c, s = np.cos(np.radians(degrees)), np.sin(np.radians(degrees))
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+def compose(*matrices):
+    '''Matrix applying the given maps right to left, like nested sd transforms.
+    compose(rotate(a), translate(x, y)) matches sd.rotate(a)(sd.translate([x, y])(obj)).
+    '''
+    result = np.eye(3)
+    for matrix in matrices:
+        result = result @ matrix
+    return result
+
+def spread(matrix, pieces):
+    '''pieces copies of matrix, rotated evenly around the origin.'''
+    return np.array([rotate(i*360/pieces) @ matrix for i in range(pieces)])
+
+def transforms(maps, depth, accumulate=True):
+    '''All compositions of up to depth maps as a (count, 3, 3) array.
+    With accumulate the identity and every shorter composition are included,
+    which is what "base += union(copies of base)" builds.
+    >>> transforms([scale(1/3)], 2)[:, 0, 0].tolist()
+    [1.0, 0.3333333333333333, 0.1111111111111111]
+    '''
+    maps = np.asarray(maps, float)
+    level = np.eye(3)[None]
+    levels = [level]
+    for _ in range(depth):
+        level = np.matmul(maps[:, None], level[None]).reshape(-1, 3, 3)
+        levels.append(level)
+    return np.concatenate(levels) if accumulate else level
+
+def apply(matrices, polygons):
+    '''Transform each polygon by each matrix: returns a list of (n, 2) arrays.'''
+    out = []
+    for polygon in polygons:
+        polygon = np.asarray(polygon, float)
+        moved = np.einsum('kij,nj->kni', matrices[:, :2, :2], polygon) + matrices[:, None, :2, 2]
+        out += list(moved)
+    return out
+
+def instances(base, maps, depth, accumulate=True):
+    '''Polygons of an IFS fractal: base is a list of (n, 2) polygons.
+    >>> len(instances([[[0, 0], [1, 0], [0, 1]]], spread(translate(2, 0), 6), 3))
+    259
+    '''
+    return apply(transforms(maps, depth, accumulate), base)
+
+def hexagram(R):
+    '''The two triangles of svgSCAD.hexagram(R).'''
+    triangle = geom2d.circle_points(R, 3)
+    return [triangle, -triangle]
+
+def union(polygons):
+    '''Merge polygons in-process into shapely geometry (requires shapely).'''
+    shapely = geom2d.shapely
+    return shapely.union_all(shapely.polygons(list(polygons)))
+
+def merged(base, maps, depth):
+    '''Union of an accumulated IFS fractal as shapely geometry (requires shapely).
+    Uses self-similarity: level k is the base plus each map applied to the merged
+    level k-1, so each step unions len(maps)+1 outlines rather than every instance.
+    '''
+    shape = union(base)
+    figure = shape
+    for _ in range(depth):
+        copies = [geom2d.transform(figure, m) for m in np.asarray(maps, float)]
+        figure = geom2d.shapely.union_all([shape, *copies])
+    return figure
+
+def _geometry(polygons):
+    # Already merged shapely geometry, or a list of polygons to merge.
+    return polygons if hasattr(polygons, 'geom_type') else union(polygons)
+
+def to_scad(polygons):
+    '''solid2 object for the union of polygons (a list, or geometry from merged).
+    The outlines are merged in-process when shapely is available, giving one
+    polygon(); otherwise OpenSCAD gets a flat union of polygons.
+    '''
+    if geom2d.shapely is None:
+        return sd.union()(*[sd.polygon(np.asarray(p).tolist()) for p in polygons])
+    return geom2d.to_scad(_geometry(polygons))
+
+def backend(polygons, fn):
+    '''scadSVG backend taking polygons (or geometry from merged) instead of a solid2 object.'''
+    if geom2d.shapely is None:
+        return svg.openscad_backend(to_scad(polygons), fn)
+    return geom2d.svg_info(_geometry(polygons))
+
+def scadSVG(polygons, fn=256, stroke=None, fill=None, strokewidth=None):
+    return svg.scadSVG(polygons, fn, stroke, fill, strokewidth, backend=backend)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
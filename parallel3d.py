@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+'''Render the separate parts of a 3D model as concurrent OpenSCAD jobs.
+OpenSCAD renders a union in one single-threaded job even when its children
+are laid out apart, like the pieces of CubOctPuzzle or the rings of
+HeartTwist. Here the children of the top-level union are grouped by
+overlapping bounding boxes, which are worked out from the solid2 tree
+without rendering, and every group is exported on its own, in parallel.
+Disjoint groups need no boolean work between them, so their meshes are
+simply concatenated into one STL.
+
+    stl = parallel3d.render_stl(final, fn=45)
+
+Only ASCII STL is produced; 3MF output would need a mesh writer and is not covered.
+'''
+
+import concurrent.futures
+import os
+import numpy as np
+import solid2 as sd
+import svgSCAD as svg
+
+# The # % * modifiers, which have no solid2 _name. root (!) is left out on purpose:
+# it changes what the whole model renders, so trees holding it are never split.
+MODIFIERS = (sd.debug, sd.background, sd.disable)
+
+def _box(lo, hi):
+    return np.array(lo, float), np.array(hi, float)
+
+def _join(boxes):
+    boxes = list(boxes)
+    if any(box is None for box in boxes):
+        return None
+    if not boxes:
+        return _box([np.inf]*3, [-np.inf]*3)
+    return np.min([lo for lo, _ in boxes], axis=0), np.max([hi for _, hi in boxes], axis=0)
+
+def _transformed(box, matrix):
+    lo, hi = box
+    if not np.all(lo <= hi):
+        return box
+    corners = np.array([[x, y, z, 1] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+    moved = corners @ matrix.T
+    return moved[:, :3].min(axis=0), moved[:, :3].max(axis=0)
+
+def _radius(params, prefix=''):
+    r = params.get(f'r{prefix}')
+    if r is None and params.get(f'd{prefix}') is not None:
+        r = params[f'd{prefix}'] / 2
+    return r
+
+def _size(params):
+    # OpenSCAD's cube() and square() without a size are 1 unit.
+    return params['size'] if params.get('size') is not None else 1
+
+def bounding_box(node):
+    '''Axis-aligned (lo, hi) corners enclosing a solid2 tree, 2D shapes lying in
+    z=0, or None when a node's extent cannot be told without rendering it.
+    Boxes are conservative: never smaller than the geometry, possibly larger.
+    >>> lo, hi = bounding_box(sd.translate([10, 0, 0])(sd.cube(2, center=True)))
+    >>> lo.tolist(), hi.tolist()
+    ([9.0, -1.0, -1.0], [11.0, 1.0, 1.0])
+    >>> bounding_box(sd.scad_inline('cube(10);')) is None
+    True
+    '''
+    name = getattr(node, '_name', None)
+    params = getattr(node, '_params', {})
+    children = getattr(node, '_children', [])
+    if name == 'cube':
+        size = np.broadcast_to(np.asarray(_size(params), float), 3)
+        return _box(-size/2, size/2) if params.get('center') else _box([0]*3, size)
+    if name == 'sphere':
+        r = svg._circle_radius(node)
+        return _box([-r]*3, [r]*3)
+    if name == 'cylinder':
+        h = params['h'] if params.get('h') is not None else 1
+        r = max(_radius(params, '1') or _radius(params) or 1, _radius(params, '2') or _radius(params) or 1)
+        z0 = -h/2 if params.get('center') else 0
+        return _box([-r, -r, z0], [r, r, z0 + h])
+    if name == 'polyhedron':
+        points = np.asarray(params['points'], float)
+        return points.min(axis=0), points.max(axis=0)
+    if name == 'square':
+        size = np.broadcast_to(np.asarray(_size(params), float), 2)
+        lo, hi = (-size/2, size/2) if params.get('center') else (np.zeros(2), size)
+        return _box([*lo, 0], [*hi, 0])
+    if name == 'circle':
+        r = svg._circle_radius(node)
+        return _box([-r, -r, 0], [r, r, 0])
+    if name == 'polygon':
+        points = np.asarray(params['points'], float)[:, :2]
+        return _box([*points.min(axis=0), 0], [*points.max(axis=0), 0])
+    if name in svg.AFFINE_NODES:
+        box = _join(bounding_box(child) for child in children)
+        return None if box is None else _transformed(box, svg.affine_matrix(node))
+    if name in ('difference',):
+        return bounding_box(children[0]) if children else _join([])
+    if name == 'intersection':
+        boxes = [bounding_box(child) for child in children]
+        known = [box for box in boxes if box is not None]
+        if not known:
+            return None
+        return np.max([lo for lo, _ in known], axis=0), np.min([hi for _, hi in known], axis=0)
+    if name == 'minkowski':
+        boxes = [bounding_box(child) for child in children]
+        if not boxes or any(box is None for box in boxes):
+            return None
+        return np.sum([lo for lo, _ in boxes], axis=0), np.sum([hi for _, hi in boxes], axis=0)
+    if name == 'offset':
+        if params.get('r') is None and params.get('delta') and not params.get('chamfer'):
+            # A delta offset mitres corners without a useful limit: acute ones spike far out.
+            return None
+        box = _join(bounding_box(child) for child in children)
+        grow = abs(params.get('r') or params.get('delta') or 0) * np.sqrt(2)
+        return None if box is None else (box[0] - [grow, grow, 0], box[1] + [grow, grow, 0])
+    if name == 'linear_extrude':
+        box = _join(bounding_box(child) for child in children)
+        if box is None:
+            return None
+        (x0, y0, _), (x1, y1, _) = box
+        scale = np.max(np.abs(np.atleast_1d(params.get('scale') or 1)))
+        if params.get('twist'):
+            r = np.hypot(max(abs(x0), abs(x1)), max(abs(y0), abs(y1)))
+            x0, y0, x1, y1 = -r, -r, r, r
+        s = max(1, scale)
+        h = params.get('height') or 100
+        z0 = -h/2 if params.get('center') else 0
+        return _box([min(x0, x0*s), min(y0, y0*s), z0], [max(x1, x1*s), max(y1, y1*s), z0 + h])
+    if name == 'rotate_extrude':
+        box = _join(bounding_box(child) for child in children)
+        if box is None:
+            return None
+        r = max(abs(box[0][0]), abs(box[1][0]))
+        return _box([-r, -r, box[0][1]], [r, r, box[1][1]])
+    if name == 'projection':
+        box = _join(bounding_box(child) for child in children)
+        return None if box is None else (np.append(box[0][:2], 0), np.append(box[1][:2], 0))
+    if name in ('union', 'hull', 'color', 'render', 'group') or isinstance(node, MODIFIERS):
+        return _join(bounding_box(child) for child in children)
+    # Anything else, e.g. scad_inline text or legacy solid objects, has an unknown extent.
+    return None
+
+def union_parts(scad_obj):
+    '''Children of the top-level union, nested unions spliced in.'''
+    if getattr(scad_obj, '_name', None) != 'union':
+        return [scad_obj]
+    parts = []
+    for child in scad_obj._children:
+        parts += union_parts(child)
+    return parts
+
+def _overlap(a, b):
+    if a is None or b is None:
+        return True
+    # Touching boxes count as overlapping: parts sharing a face must be unioned.
+    return bool(np.all(a[0] <= b[1]) and np.all(b[0] <= a[1]))
+
+def _has_root(scad_obj):
+    stack, seen = [scad_obj], set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, sd.root):
+            return True
+        stack.extend(getattr(node, '_children', []))
+    return False
+
+def disjoint_groups(scad_obj):
+    '''Parts of scad_obj grouped so that no two groups' bounding boxes meet.
+    >>> a, b = sd.cube(1), sd.translate([5, 0, 0])(sd.cube(1))
+    >>> [len(group) for group in disjoint_groups(a + b + sd.cube(2))]
+    [2, 1]
+    >>> [len(group) for group in disjoint_groups(sd.cube(10) + sd.scad_inline('cube(10);'))]
+    [2]
+    '''
+    parts = union_parts(scad_obj)
+    if _has_root(scad_obj):
+        return [parts]
+    boxes = [bounding_box(part) for part in parts]
+    group_of = list(range(len(parts)))
+
+    def find(i):
+        while group_of[i] != i:
+            group_of[i] = group_of[group_of[i]]
+            i = group_of[i]
+        return i
+
+    for i in range(len(parts)):
+        for j in range(i):
+            if _overlap(boxes[i], boxes[j]):
+                group_of[find(i)] = find(j)
+    groups = {}
+    for i, part in enumerate(parts):
+        groups.setdefault(find(i), []).append(part)
+    return list(groups.values())
+
+def merge_ascii_stl(texts, name='svgSCAD'):
+    '''One ASCII STL solid holding the facets of several.'''
+    body = []
+    for text in texts:
+        lines = text.strip().splitlines()
+        body += [line for line in lines if not line.lstrip().startswith(('solid', 'endsolid'))]
+    return '\n'.join([f'solid {name}', *body, f'endsolid {name}']) + '\n'
+
+def render_stl(scad_obj, fn=256, jobs=None):
+    '''ASCII STL of scad_obj, rendering its disjoint parts as concurrent OpenSCAD jobs.'''
+    groups = disjoint_groups(scad_obj)
+    texts = [svg.scad_text(group[0] if len(group) == 1 else sd.union()(*group), fn) for group in groups]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(texts)))
+    # Probe OpenSCAD once here rather than from every worker at the same time.
+    backend = svg.choose_backend('3D')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        stls = list(pool.map(lambda text: svg.openscad_export(text, 'asciistl', backend), texts))
+    return merge_ascii_stl(stls)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -2,99 +2,1770 @@
 
 import solid2 as sd
 import numpy as np
+import asyncio
+import os
+import re
 import pathlib
 import tempfile
 import subprocess
-import shlex
+import sys
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import hashlib
+import importlib.util
+import textwrap
+import threading
+import time
+import weakref
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; eviction is then unlocked.
+    fcntl = None
+
+def load_script(path):
+    '''Import a model script such as HeartTwist.scad.py without running its main block.'''
+    path = pathlib.Path(path)
+    spec = importlib.util.spec_from_file_location(path.name.split('.')[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Instrumentation: each stage of a render is reported to the listeners as an event
+# dict with 'stage', 'wall' and 'cpu' seconds of the calling thread, and whatever
+# sizes and counts the stage knows about. Stages: scad_render, cache, openscad,
+# parse, serialize; openscad adds the child process's own child_cpu.
+listeners = []
+
+def add_listener(callback):
+    '''Call callback(event) for every stage event, from whichever thread ran the stage.'''
+    listeners.append(callback)
+
+def remove_listener(callback):
+    listeners.remove(callback)
+
+@contextlib.contextmanager
+def recording():
+    '''Collect the events of everything rendered inside the with block.
+    >>> with recording() as events:
+    ...     text = scad_text(sd.circle(1), 8)
+    >>> [(event['stage'], event['scad_bytes']) for event in events]
+    [('scad_render', 21)]
+    '''
+    events = []
+    add_listener(events.append)
+    try:
+        yield events
+    finally:
+        remove_listener(events.append)
+
+@contextlib.contextmanager
+def stage(name, **details):
+    '''Time the with block as stage name and report it to the listeners.
+    The block may add to the event it is given. Also usable around caller code,
+    e.g. with stage('build'): to time tree building alongside the rest.
+    '''
+    event = {'stage':name, **details}
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield event
+    except BaseException as e:
+        event['error'] = repr(e)
+        raise
+    finally:
+        event['wall'] = time.perf_counter() - wall
+        event['cpu'] = time.thread_time() - cpu
+        for callback in list(listeners):
+            callback(event)
+
+_openscad_time = re.compile(r'^\s*(Total rendering time|Compiling design[^:]*|[\w ]+ time):\s*'
+    r'(?:(\d+):(\d+):([\d.]+)|(\d+) hours?, (\d+) minutes?, ([\d.]+) seconds?)', re.M)
+
+def openscad_timings(stderr):
+    r'''Seconds OpenSCAD reports for its own stages on stderr, both the current
+    h:mm:ss.fff format and the older "h hours, m minutes, s seconds" one.
+    >>> openscad_timings('Total rendering time: 0:00:01.250\n')
+    {'Total rendering time': 1.25}
+    >>> openscad_timings('Total rendering time: 0 hours, 2 minutes, 3 seconds')
+    {'Total rendering time': 123.0}
+    '''
+    timings = {}
+    for match in _openscad_time.finditer(stderr):
+        h, m, s = (match.group(2), match.group(3), match.group(4)) if match.group(2) else match.group(5, 6, 7)
+        timings[match.group(1).strip()] = int(h)*3600 + int(m)*60 + float(s)
+    return timings
+
+def summarize(events):
+    '''Totals per stage: count, wall, cpu and the sum of the other numeric fields but fn.
+    Peak memory fields (*_maxrss_kb) keep their maximum instead.
+    >>> summarize([{'stage':'parse', 'wall':1.0, 'cpu':0.5, 'paths':2}] * 2)
+    {'parse': {'count': 2, 'wall': 2.0, 'cpu': 1.0, 'paths': 4}}
+    '''
+    totals = {}
+    for event in events:
+        total = totals.setdefault(event['stage'], {'count':0})
+        total['count'] += 1
+        for field, value in event.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and field != 'fn':
+                if field.endswith('_maxrss_kb'):
+                    total[field] = max(total.get(field, 0), value)
+                else:
+                    total[field] = total.get(field, 0) + value
+    return totals
+
+def absolute_imports(scad_obj):
+    '''scad_obj with import()/surface() nodes pointing at absolute paths, so the SCAD
+    text renders the same from any directory. Relative names resolve against the
+    current directory, so this does not change what gets imported.
+    Only the nodes on the way to an import are copied; the input is not modified.
+    >>> node = sd.import_('foo.svg')
+    >>> absolute_imports(node)._params['file'] == node._params['file']
+    False
+    >>> node._params['file']
+    'foo.svg'
+    '''
+    memo = {}
+
+    def point(node):
+        key = id(node)
+        if key in memo:
+            return memo[key][1]
+        params = getattr(node, '_params', None)
+        result = node
+        if getattr(node, '_name', None) in ('import', 'surface') and params.get('file'):
+            absolute = pathlib.Path(params['file']).absolute().as_posix()
+            if absolute != params['file']:
+                result = copy.copy(node)
+                result._params = {**params, 'file':absolute}
+        children = getattr(node, '_children', [])
+        new_children = [point(child) for child in children]
+        if any(new is not old for new, old in zip(new_children, children)):
+            if result is node:
+                result = copy.copy(node)
+            result._children = new_children
+        memo[key] = (node, result)
+        return result
+
+    return point(scad_obj)
+
+def scad_text(scad_obj, fn):
+    '''SCAD source handed to OpenSCAD for scad_obj at resolution fn and the current lod.
+    >>> scad_text(sd.circle(1), 8)
+    '$fn=8;circle(r = 1);\\n'
+    '''
+    scad_obj, fn = at_detail(scad_obj, fn)
+    with stage('scad_render', fn=fn) as event:
+        text = scad_render_shared(absolute_imports(scad_obj), file_header=f'$fn={fn};')
+        event['scad_bytes'] = len(text)
+    return text
+
+AFFINE_NODES = ('translate', 'rotate', 'scale', 'mirror', 'multmatrix')
+
+def _rotation(axis, degrees):
+    '''3x3 rotation about a unit axis (Rodrigues).'''
+    x, y, z = axis
+    c, s = np.cos(np.radians(degrees)), np.sin(np.radians(degrees))
+    K = np.array([[0, -z, y], [z, 0, -x], [-y, x, 0]])
+    return np.eye(3) + s*K + (1 - c)*(K @ K)
+
+def affine_matrix(node):
+    '''4x4 matrix of a translate/rotate/scale/mirror/multmatrix node, as OpenSCAD applies it.
+    >>> affine_matrix(sd.translate([1, 2])(sd.square(1)))[:3, 3].tolist()
+    [1.0, 2.0, 0.0]
+    >>> bool((affine_matrix(sd.mirror([0, 0])(sd.square(1))) == np.eye(4)).all())
+    True
+    '''
+    name, params = node._name, node._params
+    m = np.eye(4)
+    if name == 'translate':
+        v = np.atleast_1d(np.asarray(params['v'], float))
+        m[:len(v), 3] = v
+    elif name == 'rotate':
+        a, v = params['a'], params.get('v')
+        if np.ndim(a):
+            x, y, z = (list(a) + [0, 0])[:3]
+            m[:3, :3] = _rotation((0, 0, 1), z) @ _rotation((0, 1, 0), y) @ _rotation((1, 0, 0), x)
+        else:
+            v = np.asarray(v if v is not None else (0, 0, 1), float)
+            m[:3, :3] = _rotation(v / np.linalg.norm(v), a)
+    elif name == 'scale':
+        v = params['v']
+        v = [v, v, v] if not np.ndim(v) else (list(v) + [1, 1])[:3]
+        m[:3, :3] = np.diag(np.asarray(v, float))
+    elif name == 'mirror':
+        n = np.asarray((list(params['v']) + [0, 0])[:3], float)
+        # OpenSCAD leaves the child alone when mirrored in the zero vector.
+        if n @ n:
+            m[:3, :3] -= 2 * np.outer(n, n) / (n @ n)
+    elif name == 'multmatrix':
+        given = np.asarray(params['m'], float)
+        m[:given.shape[0], :given.shape[1]] = given
+    else:
+        raise ValueError(f'{name} is not an affine node')
+    return m
+
+def _is_affine(node):
+    return getattr(node, '_name', None) in AFFINE_NODES
+
+def count_nodes(scad_obj):
+    '''Number of nodes in the tree as OpenSCAD sees it, shared subtrees counted every time.'''
+    memo = {}
+    def count(node):
+        if id(node) not in memo:
+            memo[id(node)] = 1 + sum(count(child) for child in getattr(node, '_children', []))
+        return memo[id(node)]
+    return count(scad_obj)
+
+def optimize_tree(scad_obj):
+    r'''Simplify a solid2 tree without changing its geometry:
+    chains of single-child translate/rotate/scale/mirror/multmatrix nodes become
+    one multmatrix, identity transforms disappear and nested unions are merged.
+    The input is not modified; subtrees shared in the input stay shared.
+    Returns the new tree and {'nodes_before':..., 'nodes_after':...}.
+    >>> tree = sd.rotate(90)(sd.translate([1, 0])(sd.union()(sd.union()(sd.square(1), sd.circle(1)))))
+    >>> sd.scad_render(optimize_tree(tree)[0])
+    'multmatrix(m = [[0.0, -1.0, 0.0, 0.0], [1.0, 0.0, 0.0, 1.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]]) {\n\tsquare(size = 1);\n\tcircle(r = 1);\n}\n'
+    >>> tree = sd.rotate(90)(sd.translate([5, 0])(sd.square(1), sd.circle(1)))
+    >>> sd.scad_render(optimize_tree(tree)[0])
+    'multmatrix(m = [[0.0, -1.0, 0.0, 0.0], [1.0, 0.0, 0.0, 5.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]]) {\n\tsquare(size = 1);\n\tcircle(r = 1);\n}\n'
+    >>> sd.scad_render(optimize_tree(sd.translate([0, 0])())[0])
+    'union();\n'
+    '''
+    memo = {}
+
+    def rebuild(node, children):
+        new = copy.copy(node)
+        new._children = children
+        return new
+
+    def union_children(nodes):
+        # Children of a union may be spliced in where a union is expected.
+        merged = []
+        for child in nodes:
+            if getattr(child, '_name', None) == 'union' and type(child) is type(sd.union()):
+                merged += child._children
+            else:
+                merged.append(child)
+        return merged
+
+    def optimize(node):
+        key = id(node)
+        if key in memo:
+            return memo[key][1]
+        if not hasattr(node, '_children'):
+            result = node
+        elif _is_affine(node):
+            matrix = np.eye(4)
+            chain = node
+            depth = 0
+            while True:
+                matrix = matrix @ affine_matrix(chain)
+                depth += 1
+                if len(chain._children) != 1 or not _is_affine(chain._children[0]):
+                    break
+                chain = chain._children[0]
+            children = union_children([optimize(child) for child in chain._children])
+            if np.allclose(matrix, np.eye(4), rtol=0, atol=1e-12):
+                result = children[0] if len(children) == 1 else sd.union()(*children)
+            elif depth == 1:
+                result = rebuild(node, children)
+            else:
+                matrix[np.abs(matrix) < 1e-12] = 0
+                result = sd.multmatrix(m=matrix.tolist())(*children)
+        elif getattr(node, '_name', None) == 'union':
+            children = union_children([optimize(child) for child in node._children])
+            result = children[0] if len(children) == 1 else rebuild(node, children)
+        else:
+            result = rebuild(node, [optimize(child) for child in node._children])
+        memo[key] = (node, result)
+        return result
+
+    result = optimize(scad_obj)
+    return result, {'nodes_before':count_nodes(scad_obj), 'nodes_after':count_nodes(result)}
+
+# Level of detail: 'final', or 'draft' for quick previews while designing.
+# Set it here, with the level_of_detail context manager or SVGSCAD_LOD=draft.
+lod = os.environ.get('SVGSCAD_LOD', 'final')
+# Most circle segments a draft render uses, whatever $fn asks for.
+draft_fn = 32
+
+def detail(final, draft):
+    '''Pick a model parameter by level of detail, e.g. iterations=detail(5, 2).'''
+    return draft if lod == 'draft' else final
+
+@contextlib.contextmanager
+def level_of_detail(level):
+    '''Render at level ('draft' or 'final') inside the with block.'''
+    global lod
+    previous, lod = lod, level
+    try:
+        yield
+    finally:
+        lod = previous
+
+def _circle_radius(node):
+    '''Radius of a circle or sphere node from r or d, 1 when neither is given, as in OpenSCAD.'''
+    params = node._params
+    if params.get('r') is not None:
+        return params['r']
+    return params['d'] / 2 if params.get('d') is not None else 1
+
+def draft_tree(scad_obj, fn):
+    r'''Cheaper stand-in for a tree, returned with its draft $fn.
+    $fn is capped at draft_fn everywhere. minkowski with circles becomes an
+    offset, which OpenSCAD computes far faster; any other minkowski is
+    replaced by its first child. Unchanged subtrees are shared with the input.
+    >>> tree, fn = draft_tree(sd.minkowski()(sd.square(2), sd.circle(1, _fn=100)), 256)
+    >>> sd.scad_render(tree), fn
+    ('offset(r = 1) {\n\tsquare(size = 2);\n}\n', 32)
+    '''
+    memo = {}
+
+    def cheapen(node):
+        key = id(node)
+        if key in memo:
+            return memo[key][1]
+        children = getattr(node, '_children', [])
+        if getattr(node, '_name', None) == 'minkowski' and children:
+            first, *rest = children
+            if rest and all(getattr(child, '_name', None) == 'circle' for child in rest):
+                result = sd.offset(r=sum(_circle_radius(child) for child in rest))(cheapen(first))
+            else:
+                result = cheapen(first)
+        else:
+            new_children = [cheapen(child) for child in children]
+            params = getattr(node, '_params', {})
+            capped = (params.get('_fn') or 0) > draft_fn
+            result = node
+            if capped or any(new is not old for new, old in zip(new_children, children)):
+                result = copy.copy(node)
+                result._children = new_children
+                if capped:
+                    result._params = {**params, '_fn':draft_fn}
+        memo[key] = (node, result)
+        return result
+
+    return cheapen(scad_obj), min(fn, draft_fn)
+
+def at_detail(scad_obj, fn):
+    '''The tree and $fn to render at the current level of detail.'''
+    if lod == 'draft':
+        return draft_tree(scad_obj, fn)
+    return scad_obj, fn
+
+MODIFIER_PREFIX = {'debug':'#', 'background':'%', 'root':'!', 'disable':'*'}
+
+def scad_render_shared(scad_obj, file_header=''):
+    r'''Like sd.scad_render, but identical subtrees are written once as OpenSCAD modules.
+    Subtrees are hash-consed on their rendered head and children, so a subtree
+    used many times (e.g. every copy in a fractal iteration) costs one module
+    and one call per use instead of a full copy. Output size and render time
+    follow the number of distinct nodes rather than the expanded tree.
+    >>> leaf = sd.translate([1, 0])(sd.square(1))
+    >>> scad_render_shared(sd.union()(leaf, sd.rotate(90)(leaf)))
+    'module svgscad_0() {\n\ttranslate(v = [1, 0]) {\n\t\tsquare(size = 1);\n\t}\n}\nunion() {\n\tsvgscad_0();\n\trotate(a = 90) {\n\t\tsvgscad_0();\n\t}\n}\n'
+    '''
+    from solid2.core.extension_manager import default_extension_manager as extensions
+    from solid2.core.scad_render import get_include_string
+    # Same framing as sd.scad_render: includes and extension hooks around the body.
+    includes = get_include_string()
+    extension_header = extensions.call_pre_render(scad_obj)
+    extension_header += '\n\n' if extension_header else ''
+    scad_obj = extensions.wrap_root_node(scad_obj)
+
+    keys = {}       # id(node) -> structural key number
+    nodes = []      # key number -> (head, child keys, first node seen)
+    interned = {}   # structure -> key number
+    uses = []       # key number -> references from distinct parents
+
+    def intern(node):
+        if id(node) in keys:
+            return keys[id(node)]
+        name = type(node).__name__
+        if hasattr(node, '_name'):
+            head = node._generate_scad_head()
+        elif name in MODIFIER_PREFIX:
+            head = MODIFIER_PREFIX[name]
+        else:  # Something we do not know how to split up; keep it whole.
+            head = None
+        children = tuple(intern(child) for child in node._children) if head is not None else ()
+        structure = (head, children) if head is not None else ('opaque', id(node))
+        if structure not in interned:
+            interned[structure] = len(nodes)
+            nodes.append((head, children, node))
+            uses.append(0)
+            for child in children:
+                uses[child] += 1
+        keys[id(node)] = interned[structure]
+        return keys[id(node)]
+
+    root = intern(scad_obj)
+    shared = {
+        key for key, (head, children, node) in enumerate(nodes)
+        if uses[key] > 1 and head is not None and (children or len(head) > 60)
+        }
+    names = {key:f'svgscad_{number}' for number, key in enumerate(sorted(shared))}
+
+    def body(key):
+        head, children, node = nodes[key]
+        if head is None:
+            return node._render()
+        rendered = [f'{names[child]}();\n' if child in names else body(child) for child in children]
+        if head in MODIFIER_PREFIX.values():
+            return head + ''.join(rendered)
+        if not rendered:
+            return head + ';\n'
+        return head + ' {\n' + textwrap.indent(''.join(rendered), '\t') + '}\n'
+
+    # Keys are numbered children-first, so modules are defined before they are used.
+    modules = [f'module {names[key]}() {{\n' + textwrap.indent(body(key), '\t') + '}\n' for key in sorted(shared)]
+    extension_footer = extensions.call_post_render(scad_obj)
+    extension_footer += '\n' if extension_footer else ''
+    return file_header + includes + extension_header + ''.join(modules) + body(root) + extension_footer
+
+def scratch_root():
+    '''Where render scratch directories go: tmpfs when available, else the system temp dir.'''
+    shm = pathlib.Path('/dev/shm')
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return str(shm)
+    return None
+
+@contextlib.contextmanager
+def render_sandbox():
+    '''Private scratch directory for a single OpenSCAD run, removed on exit.
+    Every call gets its own directory, so threads and processes never collide.
+    '''
+    with tempfile.TemporaryDirectory(prefix='svgSCAD-', dir=scratch_root()) as scratch:
+        yield pathlib.Path(scratch)
+
+def openscad_command(file_scad, export_format, backend=None):
+    command = ['openscad', f'--export-format={export_format}', '-o', '-', str(file_scad)]
+    flag = openscad_capabilities()['backend_flags'].get(backend) if backend else None
+    return command[:1] + ([flag] if flag else []) + command[1:]
+
+def job_type(export_format):
+    '''Whether an export is a '2D' or '3D' job.'''
+    return '2D' if export_format in EXPORT_2D else '3D'
+
+def _run_child(command, cwd):
+    '''Run command in cwd: (returncode, stdout, stderr, resource usage or None).
+    The child is reaped with os.wait4 where there is one, which gives its own CPU
+    time and peak memory whatever other threads are running at the same time.
+    '''
+    if not hasattr(os, 'wait4'):
+        p = subprocess.run(command, capture_output=True, text=True, cwd=cwd)
+        return p.returncode, p.stdout, p.stderr, None
+    # stderr goes to a file so that reading stdout alone cannot deadlock.
+    with open(pathlib.Path(cwd) / 'stderr.txt', 'w+') as err:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=err, text=True, cwd=cwd)
+        with proc.stdout:
+            stdout = proc.stdout.read()
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        err.seek(0)
+        return proc.returncode, stdout, err.read(), usage
+
+def _child_usage(event, usage):
+    if usage is not None:
+        event['child_cpu'] = usage.ru_utime + usage.ru_stime
+        # Linux reports kilobytes, macOS bytes.
+        event['child_maxrss_kb'] = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+def _openscad_output(event, returncode, stdout, stderr):
+    event['output_bytes'] = len(stdout)
+    event['openscad_timings'] = openscad_timings(stderr)
+    if returncode != 0:
+        raise RuntimeError(f'OpenSCAD failed with exit code {returncode}:\n{stderr}')
+    return stdout
+
+def openscad_export(str_scad, export_format='svg', backend=None):
+    '''Run OpenSCAD on SCAD source and return what it exports, e.g. svg or asciistl.
+    The output is read from stdout; only the SCAD input touches the disk, inside a render_sandbox.
+    backend is the geometry backend, by default choose_backend() for the job type.
+    The openscad stage event carries it, the timings OpenSCAD prints on stderr and,
+    as child_cpu and child_maxrss_kb, the CPU seconds and peak memory of the OpenSCAD process.
+    '''
+    backend = backend or choose_backend(job_type(export_format))
+    with stage('openscad', format=export_format, backend=backend, scad_bytes=len(str_scad)) as event:
+        with render_sandbox() as scratch:
+            file_scad = scratch / 'model.scad'
+            file_scad.write_text(str_scad)
+            command = openscad_command(file_scad, export_format, backend)
+            returncode, stdout, stderr, usage = _run_child(command, scratch)
+        _child_usage(event, usage)
+        return _openscad_output(event, returncode, stdout, stderr)
+
+def openscad_svg(str_scad, backend=None):
+    '''Run OpenSCAD on SCAD source and return the SVG it exports.'''
+    return openscad_export(str_scad, 'svg', backend)
+
+@functools.lru_cache(maxsize=None)
+def openscad_version():
+    '''Version line of the installed OpenSCAD, looked up once per process.'''
+    try:
+        p = subprocess.run(['openscad', '--version'], capture_output=True, text=True)
+    except OSError:
+        return 'unknown'
+    return (p.stdout + p.stderr).strip() or 'unknown'
+
+EXPORT_2D = ('svg', 'dxf', 'pdf')
+# Geometry backends, fastest first.
+BACKEND_PREFERENCE = ('Manifold', 'CGAL')
+# Backend per job type; None picks the fastest one the installed OpenSCAD has.
+# SVGSCAD_BACKEND sets both.
+job_backends = {'2D':os.environ.get('SVGSCAD_BACKEND'), '3D':os.environ.get('SVGSCAD_BACKEND')}
+
+_help_backend = re.compile(r'--backend\b[^\n]*(?:\n\s+[^-\s][^\n]*)*')
+_help_enable = re.compile(r'--enable\b[^\n]*(?:\n\s+[^-\s][^\n]*)*')
+_help_formats = re.compile(r'specifies the\s+type:\s*([\w\s,]+)', re.I)
+
+def parse_openscad_help(text):
+    '''Geometry backends and export formats from the output of openscad --help.
+    Recent builds select the backend with --backend, 2023 snapshots with --enable=manifold.
+    >>> caps = parse_openscad_help("--backend arg  3D rendering backend: 'CGAL' or 'Manifold'")
+    >>> caps['backends'], caps['backend_flags']['Manifold']
+    (['CGAL', 'Manifold'], '--backend=Manifold')
+    '''
+    backends, flags = ['CGAL'], {}
+    backend_help = _help_backend.search(text)
+    enable_help = _help_enable.search(text)
+    if backend_help:
+        backends = [name for name in ('CGAL', 'Manifold') if name.lower() in backend_help.group(0).lower()] or backends
+        flags = {name:f'--backend={name}' for name in backends}
+    elif enable_help and 'manifold' in enable_help.group(0):
+        backends.append('Manifold')
+        flags = {'Manifold':'--enable=manifold'}
+    formats = _help_formats.search(text)
+    formats = [f.strip() for f in formats.group(1).split(',') if f.strip()] if formats else []
+    if 'asciistl' in text:
+        formats += ['asciistl', 'binstl']
+    return {'backends':backends, 'backend_flags':flags, 'export_formats':formats}
+
+@functools.lru_cache(maxsize=None)
+def openscad_capabilities():
+    '''What the installed OpenSCAD offers, probed once per process:
+    {'version', 'backends', 'backend_flags', 'export_formats'}.
+    '''
+    try:
+        p = subprocess.run(['openscad', '--help'], capture_output=True, text=True)
+    except OSError:
+        return {'version':'unknown', 'backends':[], 'backend_flags':{}, 'export_formats':[]}
+    return {'version':openscad_version(), **parse_openscad_help(p.stdout + p.stderr)}
+
+def choose_backend(job='2D'):
+    '''Geometry backend for a '2D' or '3D' job: job_backends[job] when set,
+    else the first of BACKEND_PREFERENCE that OpenSCAD supports.
+    '''
+    available = openscad_capabilities()['backends']
+    chosen = job_backends.get(job)
+    if chosen:
+        if available and chosen not in available:
+            raise ValueError(f'OpenSCAD has no {chosen} backend, only {", ".join(available)}')
+        return chosen
+    return next((name for name in BACKEND_PREFERENCE if name in available), None)
+
+_imported_file = re.compile(r'\b(?:import|surface)\s*\(\s*file\s*=\s*"((?:[^"\\]|\\.)*)"')
+
+def imported_files(str_scad):
+    ''''path size mtime' for every file SCAD text loads with import() or surface(),
+    so that changing one of them changes what depends on it.
+    >>> imported_files('import(file = "/no/such.svg");')
+    ['/no/such.svg missing']
+    '''
+    found = []
+    for name in sorted(set(_imported_file.findall(str_scad))):
+        try:
+            st = os.stat(name)
+        except OSError:
+            found.append(f'{name} missing')
+        else:
+            found.append(f'{name} {st.st_size} {st.st_mtime_ns}')
+    return found
+
+class RenderCache:
+    '''Content-addressed on-disk cache of OpenSCAD output, SVG or any other export format.
+    Entries are keyed by a hash of the SCAD text, $fn, the OpenSCAD version, backend and format.
+    Files the SCAD text imports count too, through their size and modification time.
+    Writes go to a private file that is renamed into place, so several processes
+    can share one directory. Hits refresh the file time, and once the directory
+    grows past max_bytes the least recently used entries are removed.
+    '''
+    # Puts between full rescans of the directory, which also catch what other processes wrote.
+    rescan_every = 256
+    # Seconds after which a leftover .tmp file is taken to be from a crashed writer.
+    stale_tmp = 3600
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME', pathlib.Path.home() / '.cache')
+            directory = os.environ.get('SVGSCAD_CACHE_DIR', pathlib.Path(cache_home) / 'svgSCAD')
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('SVGSCAD_CACHE_MB', 512)) * 2**20
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Estimated directory size, None until the first scan.
+        self._bytes = None
+        self._puts = 0
+
+    def key(self, str_scad, fn, backend=None, export_format='svg'):
+        '''Key of a render; it ends in the format, which names the cached file's suffix.'''
+        digest = hashlib.sha256()
+        for part in (openscad_version(), str(backend), str(fn), export_format, str_scad, *imported_files(str_scad)):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return f'{digest.hexdigest()}.{export_format}'
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def get(self, key):
+        '''Cached output for key, or None.'''
+        path = self._path(key)
+        try:
+            str_svg = path.read_text()
+            os.utime(path)
+        except FileNotFoundError:  # Never stored, or evicted by another process.
+            str_svg = None
+        with self._lock:
+            if str_svg is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return str_svg
+
+    def put(self, key, str_svg):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(str_svg)
+        os.replace(tmpname, path)
+        with self._lock:
+            self._puts += 1
+            if self._bytes is not None:
+                self._bytes += len(str_svg)
+            rescan = self._bytes is None or self._bytes > self.max_bytes or self._puts % self.rescan_every == 0
+        if rescan:
+            self.evict()
+
+    def entries(self):
+        '''(mtime, size, path) for each cached render.'''
+        found = []
+        for path in self.directory.glob('*/*.*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def evict(self):
+        '''Drop least recently used entries until the cache fits in max_bytes.
+        Temporary files that crashed writers left behind are removed too.
+        Only one process evicts at a time; the others skip it.
+        '''
+        with open(self.directory / '.lock', 'a') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+            stale = time.time() - self.stale_tmp
+            for path in self.directory.glob('*/*.tmp'):
+                try:
+                    if path.stat().st_mtime < stale:
+                        path.unlink()
+                except FileNotFoundError:
+                    pass
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+            with self._lock:
+                self._bytes = total
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._bytes = None
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits':self.hits,
+            'misses':self.misses,
+            'entries':len(entries),
+            'bytes':sum(size for _, size, _ in entries),
+            }
+
+# Shared by scad_text_export (scad2svg, render_many, sweep.py). Set to None to always run OpenSCAD.
+render_cache = None if os.environ.get('SVGSCAD_CACHE') == '0' else RenderCache()
+
+def _cache_lookup(cache, str_scad, fn, backend, export_format='svg'):
+    with stage('cache', fn=fn, backend=backend, format=export_format) as event:
+        key = cache.key(str_scad, fn, backend, export_format)
+        output = cache.get(key)
+        event['hit'] = output is not None
+    return key, output
+
+# Text every complete export of a format contains; failed renders are not cached.
+EXPORT_MARKERS = {'svg':'<svg', 'asciistl':'endsolid'}
+
+def _complete(output, export_format):
+    return bool(output) and EXPORT_MARKERS.get(export_format, '') in output
+
+def scad_text_export(str_scad, fn, export_format='svg', backend=None):
+    '''openscad_export of SCAD source rendered at fn, from render_cache when possible.'''
+    cache = render_cache
+    backend = backend or choose_backend(job_type(export_format))
+    if cache is None:
+        return openscad_export(str_scad, export_format, backend)
+    key, output = _cache_lookup(cache, str_scad, fn, backend, export_format)
+    if output is None:
+        output = openscad_export(str_scad, export_format, backend)
+        if _complete(output, export_format):
+            cache.put(key, output)
+    return output
+
+def scad_text2svg(str_scad, fn):
+    '''SVG for SCAD source, from render_cache when possible.'''
+    return scad_text_export(str_scad, fn, 'svg')
 
 def scad2svg(scad_obj, fn):
     '''Use OpenSCAD to create SVG file from SCAD file.
-    Write and read from temporary files.
-    TODO: Is there a way to bypass using tempfiles?
-    '''
-    file_scad = tempfile.NamedTemporaryFile(delete=False)
-    file_svg = tempfile.NamedTemporaryFile(delete=False)
-    # Note that when openscad tries to import_ a SVG file, it will look for it in /tmp
-    # Thus we have to create a symlink to the temp file.
-    tmpfile = pathlib.Path(file_scad.name)
-    tmpname = pathlib.Path(tmpfile.name).symlink_to(tmpfile)
-
-    sd.scad_render_to_file(scad_obj, filepath=file_scad.name, file_header=f'$fn={fn};')
-    command = f'openscad --export-format=svg {tmpname} -o {file_svg.name}'
-    subprocess.run(shlex.split(command))
-    str_svg = open(file_svg.name).read()
+    '''
+    return scad_text2svg(scad_text(scad_obj, fn), fn)
+
+# asyncio variants, for driving many renders from one event loop. At most
+# async_jobs OpenSCAD processes (default: one per CPU) run at once per loop.
+async_jobs = None
+_async_slots = weakref.WeakKeyDictionary()
+
+def _render_slots():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_slots:
+        _async_slots[loop] = asyncio.Semaphore(async_jobs or os.cpu_count() or 1)
+    return _async_slots[loop]
+
+async def openscad_export_async(str_scad, export_format='svg', backend=None):
+    '''openscad_export on an asyncio subprocess.
+    Cancelling the task (e.g. through asyncio.wait_for) kills OpenSCAD.
+    asyncio reaps the process itself, so the event has no child_cpu.
+    '''
+    backend = backend or await asyncio.to_thread(choose_backend, job_type(export_format))
+    async with _render_slots():
+        with stage('openscad', format=export_format, backend=backend, scad_bytes=len(str_scad)) as event:
+            with render_sandbox() as scratch:
+                file_scad = scratch / 'model.scad'
+                file_scad.write_text(str_scad)
+                proc = await asyncio.create_subprocess_exec(*openscad_command(file_scad, export_format, backend),
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=scratch)
+                try:
+                    stdout, stderr = await proc.communicate()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    await proc.wait()
+                    raise
+            return _openscad_output(event, proc.returncode, stdout.decode(), stderr.decode())
+
+async def scad_text2svg_async(str_scad, fn):
+    '''scad_text2svg without blocking the event loop on OpenSCAD.'''
+    cache = render_cache
+    backend = await asyncio.to_thread(choose_backend, '2D')
+    if cache is None:
+        return await openscad_export_async(str_scad, 'svg', backend)
+    # Cache reads and writes touch the disk, so they stay off the event loop too.
+    key, str_svg = await asyncio.to_thread(_cache_lookup, cache, str_scad, fn, backend)
+    if str_svg is None:
+        str_svg = await openscad_export_async(str_scad, 'svg', backend)
+        if _complete(str_svg, 'svg'):
+            await asyncio.to_thread(cache.put, key, str_svg)
     return str_svg
 
+async def scad2svg_async(scad_obj, fn):
+    '''Awaitable scad2svg. The SCAD text is generated in a worker thread,
+    so large trees do not stall the event loop either.
+    '''
+    str_scad = await asyncio.to_thread(scad_text, scad_obj, fn)
+    return await scad_text2svg_async(str_scad, fn)
+
+def openscad_backend(scad_obj, fn):
+    '''Default scadSVG backend: render with OpenSCAD and parse its SVG.
+    A backend takes (scad_obj, fn) and returns a parse_svg style dict.
+    '''
+    return parse_svg(scad2svg(scad_obj, fn))
+
+# Used by scadSVG when no backend is given, e.g. geom2d.backend for in-process 2D.
+default_backend = openscad_backend
+
+def render_many(scad_objs, fn=256, jobs=None):
+    '''Render several SCAD objects to SVG strings, in submission order.
+    The SCAD text is generated here, then up to jobs OpenSCAD processes run at once
+    (default: one per CPU). Threads are enough to drive the pool since all the
+    work happens in the OpenSCAD child processes.
+    '''
+    texts = [scad_text(scad_obj, fn) for scad_obj in scad_objs]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(texts)))
+    render = functools.partial(scad_text2svg, fn=fn)
+    if jobs == 1:
+        return [render(text) for text in texts]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(render, texts))
+
+def scadSVG_many(scad_objs, fn=256, jobs=None, stroke=None, fill=None, strokewidth=None):
+    '''Build one scadSVG per object, rendering them concurrently with render_many.
+    '''
+    str_svgs = render_many(scad_objs, fn=fn, jobs=jobs)
+    return [scadSVG(None, fn, stroke, fill, strokewidth, str_svg=str_svg) for str_svg in str_svgs]
+
+def render_layers(layers, fn=256, jobs=None, backend=None):
+    '''Render named layers concurrently and stack them into one document.
+    layers maps a name to (scad_obj, style), where style holds scadSVG keyword
+    arguments, e.g. {'cut':(outline, {'stroke':'red'}), 'etch':(art, {'fill':'black'})}.
+    Layers are stacked in the order given, the first at the bottom, and each
+    path gets its layer name as id. Returns the document and the seconds each
+    layer took; every layer is also reported as a 'layer' stage event.
+    '''
+    names = list(layers)
+    if not names:
+        raise ValueError('render_layers needs at least one layer')
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(names)))
+    def render(name):
+        scad_obj, style = layers[name]
+        with stage('layer', layer=name, fn=fn) as event:
+            doc = scadSVG(scad_obj, fn, backend=backend, **style)
+        return doc, event['wall']
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        rendered = list(pool.map(render, names))
+    document, timings = None, {}
+    for name, (doc, wall) in zip(names, rendered):
+        doc = scadSVG.from_layers([layer.restyled(id=name) for layer in doc.layers], fn, doc.units)
+        document = doc if document is None else document + doc
+        timings[name] = wall
+    return document, timings
+
+_svg_tag = re.compile(r'<(svg|path)\b([^>]*)>', re.S)
+_svg_attr = re.compile(r'([\w:-]+)\s*=\s*"([^"]*)"')
+_svg_length = re.compile(r'\s*([-+]?[\d.]+(?:[eE][-+]?\d+)?)\s*([a-z%]*)\s*$')
+# Path commands OpenSCAD emits: absolute moveto, lineto and closepath.
+_path_separators = str.maketrans({',':' ', 'L':' ', 'Z':' ', 'z':' ', 'M':' M '})
+_path_unsupported = re.compile(r'[A-DF-KN-Ya-df-y]')
+
+def iter_svg_tags(chunks):
+    '''Yield (name, attrs) for each <svg> and <path> tag as soon as it is complete.
+    chunks is a string or any iterable of text, e.g. an open file or a pipe.
+    >>> list(iter_svg_tags(['<svg width="2mm">', '<path d="M 0', ',0 L 1,0 z"/>']))
+    [('svg', {'width': '2mm'}), ('path', {'d': 'M 0,0 L 1,0 z'})]
+    '''
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    pending = []
+    for chunk in chunks:
+        pending.append(chunk)
+        if '>' not in chunk:
+            continue
+        buf = ''.join(pending)
+        pos = 0
+        for match in _svg_tag.finditer(buf):
+            yield match.group(1), dict(_svg_attr.findall(match.group(2)))
+            pos = match.end()
+        # Keep a tag that is still open for the next chunk.
+        start = buf.find('<', pos)
+        pending = [buf[start:]] if start >= 0 else []
+
+def parse_length(text):
+    '''Split an SVG length into value and unit.
+    >>> parse_length('156.0mm')
+    (156.0, 'mm')
+    '''
+    match = _svg_length.match(text)
+    if match is None:
+        raise ValueError(f'Bad SVG length: {text!r}')
+    return float(match.group(1)), match.group(2)
+
+class PathGeometry:
+    '''Subpaths of one SVG path stored as a single (n, 2) coordinate buffer.
+    offsets[i]:offsets[i+1] are the rows of subpath i, so a path with thousands of
+    outlines is two arrays rather than thousands of strings.
+    >>> geometry = PathGeometry.parse('M 0,0 L 1,0 L 1,1 z M 2,2 L 3,2 L 3,3 z')
+    >>> geometry.offsets.tolist(), geometry.bounds()
+    ([0, 3, 6], (0.0, 0.0, 3.0, 3.0))
+    >>> print(geometry.to_d())
+    M 0.0,0.0 L 1.0,0.0 L 1.0,1.0 z
+    M 2.0,2.0 L 3.0,2.0 L 3.0,3.0 z
+    '''
+    __slots__ = ('coords', 'offsets')
+
+    def __init__(self, coords, offsets):
+        self.coords = coords
+        self.offsets = offsets
+
+    @classmethod
+    def parse(cls, d, dtype=np.float64):
+        '''Build from SVG path data as written by OpenSCAD.
+        All numbers are converted in one vectorized step.
+        '''
+        if _path_unsupported.search(d):
+            raise ValueError('Only absolute M, L and Z path commands are supported')
+        tokens = np.array(d.translate(_path_separators).split())
+        is_move = tokens == 'M'
+        coords = tokens[~is_move].astype(dtype).reshape(-1, 2)
+        # Index of the first point of every subpath among the coordinate pairs.
+        starts = (np.flatnonzero(is_move) - np.arange(is_move.sum())) // 2
+        return cls(coords, np.append(starts, len(coords)))
+
+    @classmethod
+    def from_subpaths(cls, subpaths, dtype=np.float64):
+        subpaths = [np.asarray(subpath, dtype=dtype).reshape(-1, 2) for subpath in subpaths]
+        sizes = [len(subpath) for subpath in subpaths]
+        coords = np.concatenate(subpaths) if subpaths else np.empty((0, 2), dtype=dtype)
+        return cls(coords, np.cumsum([0] + sizes))
+
+    @classmethod
+    def concat(cls, geometries):
+        geometries = list(geometries)
+        if len(geometries) == 1:
+            return geometries[0]
+        coords = [g.coords for g in geometries]
+        offsets = [np.zeros(1, dtype=int)]
+        base = 0
+        for g in geometries:
+            offsets.append(g.offsets[1:] + base)
+            base += len(g.coords)
+        return cls(np.concatenate(coords) if coords else np.empty((0, 2)), np.concatenate(offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.coords[self.offsets[idx]:self.offsets[idx+1]]
+
+    def __iter__(self):
+        for start, stop in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.coords[start:stop]
+
+    @property
+    def nbytes(self):
+        return self.coords.nbytes + self.offsets.nbytes
+
+    def bounds(self):
+        '''(xmin, ymin, xmax, ymax) of all points.'''
+        (xmin, ymin), (xmax, ymax) = self.coords.min(axis=0), self.coords.max(axis=0)
+        return float(xmin), float(ymin), float(xmax), float(ymax)
+
+    def to_d(self):
+        '''SVG path data, one subpath per line.
+        One format string covers the whole path so the numbers are formatted in a single pass.
+        '''
+        fmt = '%r,%r' if self.coords.dtype == np.float64 else '%.7g,%.7g'
+        sizes = np.diff(self.offsets).tolist()
+        template = '\n'.join('M ' + ' L '.join([fmt] * size) + ' z' for size in sizes)
+        return template % tuple(self.coords.ravel().tolist())
+
+def _chord_distances(points, keep, ends=None):
+    '''Distance of every point to the chord between the kept points around it.
+    ends optionally replaces the coordinates used for the chord end points.
+    '''
+    if ends is None:
+        ends = points
+    idx = np.flatnonzero(keep)
+    seg = np.clip(np.searchsorted(idx, np.arange(len(points)), side='right') - 1, 0, len(idx) - 2)
+    a, b = ends[idx[seg]], ends[idx[seg + 1]]
+    ab = b - a
+    length2 = (ab * ab).sum(axis=1)
+    t = np.divide(((points - a) * ab).sum(axis=1), length2, out=np.zeros(len(points)), where=length2 > 0)
+    nearest = a + np.clip(t, 0, 1)[:, None] * ab
+    return np.hypot(*(points - nearest).T), seg
+
+def simplify_loop(loop, tolerance):
+    '''Ramer-Douglas-Peucker simplification of a closed loop.
+    All chords of one refinement level are handled in a single vectorized pass.
+    Returns a mask of the points to keep.
+    >>> square = np.array([[0, 0], [1, 0], [2, 0], [2, 1], [2, 2], [0, 2], [0, 1]], float)
+    >>> square[simplify_loop(square, 0.01)].tolist()
+    [[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0]]
+    '''
+    if len(loop) < 4 or tolerance <= 0:
+        return np.ones(len(loop), dtype=bool)
+    points = np.vstack([loop, loop[:1]])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    # The far side of the loop splits it into two open polylines.
+    keep[np.argmax(np.hypot(*(points - points[0]).T))] = True
+    while True:
+        dist, seg = _chord_distances(points, keep)
+        dist[keep] = 0
+        worst = np.zeros(keep.sum() - 1)
+        np.maximum.at(worst, seg, dist)
+        split = (dist == worst[seg]) & (dist > tolerance)
+        if not split.any():
+            break
+        # One new point per chord that is still too far off.
+        _, first = np.unique(seg[split], return_index=True)
+        keep[np.flatnonzero(split)[first]] = True
+    if keep.sum() < 4:  # Fewer than three distinct corners: leave the loop alone.
+        return np.ones(len(loop), dtype=bool)
+    return keep[:-1]
+
+def simplify_geometry(geometry, tolerance=0.0, precision=None):
+    '''Simplify every loop of a PathGeometry to within tolerance and snap the result
+    to a grid of size precision (both in document units, i.e. mm).
+    Returns the new geometry and the largest distance between an original point
+    and the output outline.
+    >>> geometry = PathGeometry.from_subpaths([[[0, 0], [1, 0.01], [2, 0], [2, 2], [0, 2]]])
+    >>> simple, deviation = simplify_geometry(geometry, 0.05, precision=0.5)
+    >>> simple[0].tolist(), round(deviation, 3)
+    ([[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0]], 0.01)
+    '''
+    loops = []
+    deviation = 0.0
+    for loop in geometry:
+        kept = np.flatnonzero(simplify_loop(loop, tolerance))
+        snapped = loop[kept]
+        if precision:
+            snapped = np.round(snapped / precision) * precision
+            distinct = np.any(snapped != np.roll(snapped, 1, axis=0), axis=1)
+            distinct[0] = True
+            distinct[-1] &= np.any(snapped[-1] != snapped[0])
+            if distinct.sum() >= 3:
+                kept, snapped = kept[distinct], snapped[distinct]
+        # Measure against the outline actually written, grid snapping included.
+        points = np.vstack([loop, loop[:1]])
+        keep = np.zeros(len(points), dtype=bool)
+        keep[kept] = keep[-1] = True
+        ends = points.copy()
+        ends[kept] = snapped
+        ends[-1] = snapped[0]
+        dist, _ = _chord_distances(points, keep, ends)
+        deviation = max(deviation, float(dist.max()))
+        loops.append(snapped)
+    return PathGeometry.from_subpaths(loops, dtype=geometry.coords.dtype), deviation
+
+def loop_areas(geometry):
+    '''Signed area of every loop (shoelace formula over the whole buffer at once).
+    >>> loop_areas(PathGeometry.from_subpaths([[[0, 0], [2, 0], [2, 2], [0, 2]], [[0, 0], [0, 1], [1, 0]]])).tolist()
+    [4.0, -0.5]
+    '''
+    x, y = geometry.coords.T
+    nxt = np.arange(1, len(x) + 1)
+    nxt[geometry.offsets[1:] - 1] = geometry.offsets[:-1]
+    cross = x * y[nxt] - x[nxt] * y
+    return np.add.reduceat(cross, geometry.offsets[:-1]) / 2 if len(x) else np.zeros(0)
+
+def point_in_loop(point, loop):
+    '''Even-odd ray casting test.'''
+    x, y = point
+    x0, y0 = loop.T
+    x1, y1 = np.roll(loop, -1, axis=0).T
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xs = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(crosses & (xs > x)) & 1)
+
+def loop_parents(geometry):
+    '''Index of the smallest loop enclosing each loop, or -1 for outermost loops.'''
+    count = len(geometry)
+    areas = np.abs(loop_areas(geometry))
+    lo = np.array([loop.min(axis=0) for loop in geometry]).reshape(-1, 2)
+    hi = np.array([loop.max(axis=0) for loop in geometry]).reshape(-1, 2)
+    parents = np.full(count, -1)
+    for i in range(count):
+        # Loops whose bounding box holds this one are the only candidates.
+        candidates = np.flatnonzero((lo <= lo[i]).all(axis=1) & (hi >= hi[i]).all(axis=1) & (areas > areas[i]))
+        for j in candidates[np.argsort(areas[candidates])]:
+            if point_in_loop(geometry[i][0], geometry[j]):
+                parents[i] = j
+                break
+    return parents
+
+def loop_depths(parents):
+    '''Number of loops enclosing each loop, from loop_parents.'''
+    depth = np.zeros(len(parents), dtype=int)
+    for i in range(len(parents)):
+        j = parents[i]
+        while j >= 0:
+            depth[i] += 1
+            j = parents[j]
+    return depth
+
+def loop_components(geometry):
+    '''Group loops into filled regions: [outer, hole, hole, ...] lists.
+    Islands inside holes start components of their own.
+    '''
+    parents = loop_parents(geometry)
+    depth = loop_depths(parents)
+    components = {i:[i] for i in np.flatnonzero(depth % 2 == 0).tolist()}
+    for i in np.flatnonzero(depth % 2 == 1).tolist():
+        components[int(parents[i])].append(i)
+    return list(components.values())
+
+def _rigid_match(a_loops, b_loops, tol):
+    '''Rotation and translation (R, t) with R @ a + t == b for two components given
+    as [outer, holes...] vertex arrays, or None when they are not congruent.
+    '''
+    a, b = a_loops[0], b_loops[0]
+    if len(a) != len(b) or len(a_loops) != len(b_loops):
+        return None
+    la = np.hypot(*(np.roll(a, -1, axis=0) - a).T)
+    lb = np.hypot(*(np.roll(b, -1, axis=0) - b).T)
+    for k in np.flatnonzero(np.abs(lb - la[0]) <= tol):
+        b_shift = np.roll(b, -k, axis=0)
+        # Least squares rotation about the centroids (2D Kabsch).
+        ca, cb = a.mean(axis=0), b_shift.mean(axis=0)
+        da, db = a - ca, b_shift - cb
+        angle = np.arctan2((da[:, 0]*db[:, 1] - da[:, 1]*db[:, 0]).sum(), (da * db).sum())
+        R = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        t = cb - R @ ca
+        if np.abs(a @ R.T + t - b_shift).max() > tol:
+            continue
+        holes = [b_hole for b_hole in b_loops[1:]]
+        for a_hole in a_loops[1:]:
+            moved = a_hole @ R.T + t
+            for h, b_hole in enumerate(holes):
+                if len(b_hole) != len(moved):
+                    continue
+                start = np.argmin(np.hypot(*(b_hole - moved[0]).T))
+                if np.abs(np.roll(b_hole, -start, axis=0) - moved).max() <= tol:
+                    del holes[h]
+                    break
+            else:
+                break
+        else:
+            return R, t
+    return None
+
+def congruent_components(geometry, tol=1e-3):
+    '''Find filled regions that are rotated/translated copies of each other.
+    Candidates are bucketed by a rigid-motion invariant signature (vertex counts,
+    area, sorted edge lengths) and then checked point by point.
+    Returns [(template, [(component, R, t), ...]), ...] for every class with at
+    least two members, where components are lists of loop indices.
+    '''
+    areas = loop_areas(geometry)
+    buckets = {}
+    for component in loop_components(geometry):
+        outer = geometry[component[0]]
+        edges = np.hypot(*(np.roll(outer, -1, axis=0) - outer).T)
+        signature = (
+            tuple(len(geometry[i]) for i in component[:1]),
+            len(component),
+            round(float(areas[component].sum()), 2),
+            hash(tuple(np.round(np.sort(edges), 2).tolist())),
+            )
+        buckets.setdefault(signature, []).append(component)
+    classes = []
+    for members in buckets.values():
+        while len(members) > 1:
+            template, rest = members[0], members[1:]
+            template_loops = [geometry[i] for i in template]
+            found, members = [(template, np.eye(2), np.zeros(2))], []
+            for component in rest:
+                match = _rigid_match(template_loops, [geometry[i] for i in component], tol)
+                if match is None:
+                    members.append(component)
+                else:
+                    found.append((component, *match))
+            if len(found) > 1:
+                classes.append((template, found))
+    return classes
+
+def travel_distance(geometry, start=(0, 0)):
+    '''Rapid travel needed to cut the loops in order, each starting and ending at
+    its first vertex. Returns the distance and where the head ends up.
+    >>> travel_distance(PathGeometry.from_subpaths([[[3, 4], [4, 4], [4, 5]], [[3, 0], [3, 1], [2, 1]]]))
+    (9.0, (3.0, 0.0))
+    '''
+    points = np.vstack([np.reshape(start, (1, 2)), geometry.coords[geometry.offsets[:-1]]])
+    distance = float(np.hypot(*np.diff(points, axis=0).T).sum())
+    return distance, tuple(points[-1].tolist())
+
+def _nearest_loops(geometry, parents, start):
+    # Greedy nearest neighbour over the loops whose enclosed loops are all done.
+    count = len(geometry)
+    lo = np.array([loop.min(axis=0) for loop in geometry])
+    hi = np.array([loop.max(axis=0) for loop in geometry])
+    pending = np.bincount(parents[parents >= 0], minlength=count)
+    available = pending == 0
+    order, entries = [], []
+    position = np.asarray(start, float)
+    for _ in range(count):
+        # Distance to a bounding box is a lower bound for distance to the loop.
+        bound = np.hypot(*np.maximum(np.maximum(lo - position, position - hi), 0).T)
+        bound[~available] = np.inf
+        best, best_loop, best_vertex = np.inf, -1, 0
+        while True:
+            k = int(np.argmin(bound))
+            if bound[k] >= best and best_loop >= 0:
+                break
+            distances = np.hypot(*(geometry[k] - position).T)
+            vertex = int(np.argmin(distances))
+            if distances[vertex] < best or best_loop < 0:
+                best, best_loop, best_vertex = distances[vertex], k, vertex
+            bound[k] = np.inf
+            if not np.isfinite(bound).any():
+                break
+        order.append(best_loop)
+        entries.append(best_vertex)
+        position = geometry[best_loop][best_vertex]
+        available[best_loop] = False
+        parent = parents[best_loop]
+        if parent >= 0:
+            pending[parent] -= 1
+            available[parent] = pending[parent] == 0
+    return np.array(order), np.array(entries)
+
+def _two_opt(tour, order, parents, passes, window=256):
+    # tour is the start followed by the entry point of every loop in order.
+    # Reverse runs of the tour while that shortens it and
+    # no loop in the run encloses another one in the run. Runs are limited to
+    # window loops, which keeps a pass linear in the number of loops.
+    count = len(order)
+    position = np.empty(count, dtype=int)
+    position[order] = np.arange(count)
+    for _ in range(passes):
+        improved = False
+        for a in range(count - 1):
+            prev, first = tour[a], tour[a + 1]
+            ends = tour[a + 1:a + 1 + window]
+            after = tour[a + 2:a + 2 + window]
+            open_end = len(after) < len(ends)
+            if open_end:  # The run may reach the end of the tour, which has nothing after it.
+                after = np.vstack([after, ends[-1:]])
+            gain = np.hypot(*(first - prev)) - np.hypot(*(ends - prev).T) + np.hypot(*(after - ends).T) - np.hypot(*(after - first).T)
+            if open_end:
+                gain[-1] = np.hypot(*(first - prev)) - np.hypot(*(ends[-1] - prev))
+            gain[0] = 0
+            for b in np.argsort(-gain)[:4]:
+                if gain[b] <= 1e-9:
+                    break
+                run = order[a:a + b + 1]
+                enclosing = parents[run]
+                enclosing = enclosing[enclosing >= 0]
+                if np.any((position[enclosing] >= a) & (position[enclosing] <= a + b)):
+                    continue
+                order[a:a + b + 1] = run[::-1].copy()
+                tour[a + 1:a + b + 2] = tour[a + 1:a + b + 2][::-1].copy()
+                position[order[a:a + b + 1]] = np.arange(a, a + b + 1)
+                improved = True
+                break
+        if not improved:
+            break
+    return order
+
+def order_loops(geometry, start=(0, 0), direction=None, passes=20):
+    '''Reorder loops for cutting with little rapid travel: every loop is cut
+    before any loop enclosing it, so parts do not drop out before their inner
+    features are done. Loops are visited nearest neighbour first, improved by
+    2-opt, and each starts at the vertex closest to the head's path.
+    direction 'ccw' or 'cw' sets how outer contours run as seen on the sheet,
+    holes run the other way so the nonzero fill rule still holds.
+    Returns the new geometry and where the head ends up.
+    >>> square = lambda x, y, s: [[x, y], [x + s, y], [x + s, y + s], [x, y + s]]
+    >>> loops = PathGeometry.from_subpaths([square(0, 0, 10), square(20, 0, 2), square(4, 4, 2)])
+    >>> ordered, end = order_loops(loops)
+    >>> [loop[0].tolist() for loop in ordered], end
+    ([[4.0, 4.0], [10.0, 0.0], [20.0, 0.0]], (20.0, 0.0))
+    '''
+    count = len(geometry)
+    if count == 0:
+        return geometry, tuple(np.asarray(start, float).tolist())
+    parents = loop_parents(geometry)
+    order, entries = _nearest_loops(geometry, parents, start)
+    tour = np.vstack([np.reshape(np.asarray(start, float), (1, 2)), [geometry[k][v] for k, v in zip(order, entries)]])
+    entry_of = dict(zip(order.tolist(), entries.tolist()))
+    order = _two_opt(tour, order.copy(), parents, passes)
+    # Start each loop at the vertex closest to the way from the previous loop to the next.
+    entries = [entry_of[k] for k in order.tolist()]
+    for _ in range(2):
+        previous = np.asarray(start, float)
+        for i, k in enumerate(order.tolist()):
+            loop = geometry[k]
+            cost = np.hypot(*(loop - previous).T)
+            if i + 1 < count:
+                cost = cost + np.hypot(*(loop - geometry[order[i + 1]][entries[i + 1]]).T)
+            entries[i] = int(np.argmin(cost))
+            previous = loop[entries[i]]
+    if direction is not None:
+        if direction not in ('ccw', 'cw'):
+            raise ValueError(f"direction must be 'ccw', 'cw' or None, not {direction!r}")
+        # y points down on the sheet, so counterclockwise there is a negative shoelace area.
+        outer_sign = -1 if direction == 'ccw' else 1
+        flip = np.sign(loop_areas(geometry)) != np.where(loop_depths(parents) % 2 == 0, outer_sign, -outer_sign)
+    else:
+        flip = np.zeros(count, dtype=bool)
+    loops = []
+    for k, entry in zip(order.tolist(), entries):
+        loop = np.roll(geometry[k], -entry, axis=0)
+        loops.append(np.vstack([loop[:1], loop[:0:-1]]) if flip[k] else loop)
+    ordered = PathGeometry.from_subpaths(loops, geometry.coords.dtype)
+    return ordered, tuple(loops[-1][0].tolist())
+
+def parse_path_data(d):
+    '''Split SVG path data from OpenSCAD into one (n, 2) float array per subpath.
+    >>> [a.tolist() for a in parse_path_data('M 0,0 L 1,0 L 1,1 z M 2,2 L 3,2 L 3,3 z')]
+    [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0]], [[2.0, 2.0], [3.0, 2.0], [3.0, 3.0]]]
+    '''
+    return list(PathGeometry.parse(d))
+
+def parse_svg(source):
+    '''Parse OpenSCAD SVG output, given as a string or iterable of text chunks.
+    Returns the viewBox, width and height (value, unit), and the paths as
+    {'geometry':PathGeometry, 'attrs':{...}}.
+    '''
+    info = {'viewBox':None, 'width':None, 'height':None, 'paths':[]}
+    with stage('parse') as event:
+        if isinstance(source, str):
+            event['svg_bytes'] = len(source)
+        for name, attrs in iter_svg_tags(source):
+            if name == 'svg':
+                info['viewBox'] = tuple(float(v) for v in attrs['viewBox'].replace(',', ' ').split())
+                info['width'] = parse_length(attrs['width'])
+                info['height'] = parse_length(attrs['height'])
+            else:
+                geometry = PathGeometry.parse(attrs.pop('d', ''))
+                info['paths'].append({'geometry':geometry, 'attrs':attrs})
+        event['paths'] = len(info['paths'])
+        event['vertices'] = sum(len(path['geometry'].coords) for path in info['paths'])
+        if info['viewBox'] is None:
+            raise ValueError('No <svg> element found')
+    return info
+
+class Style:
+    '''How a layer is drawn, kept apart from its geometry.
+    Styles are immutable and shared between layers; replace() returns an
+    updated copy. The SVG attribute text is built once per style and reused
+    by every layer and every write that shares it. Attributes other than
+    stroke, fill, stroke-width and opacity are kept in extra, in order.
+    >>> style = Style(fill='blue').replace(opacity=0.5, id='etch')
+    >>> str(style)
+    'stroke="black" fill="blue" stroke-width="0.5" opacity="0.5" id="etch"'
+    '''
+    __slots__ = ('stroke', 'fill', 'stroke_width', 'opacity', 'extra', '_svg')
+    # Field name -> SVG attribute name.
+    FIELDS = {'stroke':'stroke', 'fill':'fill', 'stroke_width':'stroke-width', 'opacity':'opacity'}
+
+    def __init__(self, stroke='black', fill='lightgray', stroke_width=0.5, opacity=None, extra=()):
+        self.stroke = stroke
+        self.fill = fill
+        self.stroke_width = stroke_width
+        self.opacity = opacity
+        self.extra = tuple(extra)
+        self._svg = None
+
+    @classmethod
+    def from_attrs(cls, attrs):
+        '''Style from SVG attributes, e.g. those of a parse_svg path.'''
+        names = {svg_name:field for field, svg_name in cls.FIELDS.items()}
+        fields = {names[name]:value for name, value in attrs.items() if name in names}
+        if 'stroke_width' in fields:
+            fields['stroke_width'] = float(fields['stroke_width'])
+        return cls(**fields, extra=[(name, value) for name, value in attrs.items() if name not in names])
+
+    def replace(self, **changes):
+        '''Copy with changes applied. Keys are field names (stroke_width) or any other SVG attribute.'''
+        fields = {field:getattr(self, field) for field in self.FIELDS}
+        extra = dict(self.extra)
+        for name, value in changes.items():
+            if name in fields:
+                fields[name] = value
+            else:
+                extra[name] = value
+        return Style(**fields, extra=extra.items())
+
+    def attrs(self):
+        '''SVG attributes as a dict, unset ones left out.'''
+        attrs = {svg_name:getattr(self, field) for field, svg_name in self.FIELDS.items()}
+        attrs.update(self.extra)
+        return {name:value for name, value in attrs.items() if value is not None}
+
+    def __str__(self):
+        if self._svg is None:
+            self._svg = ' '.join(f'{name}="{value}"' for name, value in self.attrs().items())
+        return self._svg
+
+class Layer:
+    '''One styled SVG path: geometry, Style and the viewBox it was rendered with.
+    Layers are never modified once built, so documents share them freely.
+    '''
+    __slots__ = ('geometry', 'style', 'bounds')
+
+    def __init__(self, geometry, style, bounds):
+        self.geometry = geometry
+        self.style = style
+        self.bounds = bounds
+
+    @property
+    def attrs(self):
+        return self.style.attrs()
+
+    def restyled(self, **changes):
+        '''Copy of this layer sharing its geometry, with its style changed (see Style.replace).'''
+        return Layer(self.geometry, self.style.replace(**changes), self.bounds)
+
+class LayerList:
+    '''Immutable sequence of layers with O(1) concatenation.
+    A LayerList is either a tuple of layers or the join of two LayerLists;
+    joins are only walked when the list is iterated.
+    >>> a, b, c = LayerList(['a']), LayerList(['b']), LayerList(['c'])
+    >>> list(a + b + c), list(a), len(a + b + c)
+    (['a', 'b', 'c'], ['a'], 3)
+    '''
+    __slots__ = ('_items', '_left', '_right', '_len')
+
+    def __init__(self, items=(), left=None, right=None):
+        self._items = tuple(items)
+        self._left = left
+        self._right = right
+        self._len = len(self._items) if left is None else len(left) + len(right)
+
+    def __add__(self, other):
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        return LayerList(left=self, right=other)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        # Explicit stack: a + b + c + ... over many layers builds a deep left spine.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._left is None:
+                yield from node._items
+            else:
+                stack.append(node._right)
+                stack.append(node._left)
+
 class scadSVG:
-    def __init__(self, scad_obj, fn=256, stroke=None, fill=None, strokewidth=None):
+    '''SVG document built from OpenSCAD renders.
+    Layers are immutable and shared rather than copied: a + b returns a new
+    document whose layers are shared with a and b, and the union bounding box
+    is only computed when it is first needed. Restyling replaces layers in the
+    restyled document only, leaving the others that share them untouched.
+    '''
+    __slots__ = ('fn', 'units', 'layers', '_bounds')
+
+    def __init__(self, scad_obj, fn=256, stroke=None, fill=None, strokewidth=None, str_svg=None, backend=None, opacity=None):
+        '''str_svg may be given when the object was already rendered, e.g. by render_many.
+        Otherwise backend (default_backend when None) turns scad_obj into geometry.
+        '''
         self.fn = fn
-        str_svg = scad2svg(scad_obj, self.fn)
-        self.init_scadSVG_attrs(str_svg)
-        self.set_scadSVG_path_attrs(0, stroke, fill, strokewidth)
+        if str_svg is None:
+            info = (backend or default_backend)(*at_detail(scad_obj, self.fn))
+        else:
+            info = parse_svg(str_svg)
+        self.init_scadSVG_info(info)
+        self.set_scadSVG_path_attrs(0, stroke, fill, strokewidth, opacity)
+
+    @classmethod
+    def from_layers(cls, layers, fn=256, units='mm'):
+        doc = cls.__new__(cls)
+        doc.fn = fn
+        doc.units = units
+        doc.layers = layers if isinstance(layers, LayerList) else LayerList(layers)
+        doc._bounds = None
+        return doc
+
+    @classmethod
+    async def create(cls, scad_obj, fn=256, stroke=None, fill=None, strokewidth=None, backend=None):
+        '''Awaitable constructor: await scadSVG.create(obj, fill='blue').
+        OpenSCAD renders go through scad2svg_async; other backends and the
+        SVG parsing run in a worker thread.
+        '''
+        backend = backend or default_backend
+        if backend is openscad_backend:
+            str_svg = await scad2svg_async(scad_obj, fn)
+            return await asyncio.to_thread(cls, None, fn, stroke, fill, strokewidth, str_svg=str_svg)
+        return await asyncio.to_thread(cls, scad_obj, fn, stroke, fill, strokewidth, backend=backend)
 
     def init_scadSVG_attrs(self, str_svg):
-        '''Extract SVG dimensions and path.
-        TODO: This function is fragile. It would be better with a parser.
+        '''Extract SVG dimensions and path.'''
+        self.init_scadSVG_info(parse_svg(str_svg))
+
+    def init_scadSVG_info(self, info):
+        '''Set up a single layer from parse_svg output.
+        OpenSCAD styles all of its paths the same, so they are merged into one.
         '''
-        svglist = str_svg.splitlines()
-        info = svglist[2].split()
-        self.xmin = float(info[3][9:])
-        self.ymin = float(info[4])
-        self.width = float(info[5])
-        self.height = float(info[6][:-1])
-        self.paths = [ svglist[4:-1] ]
+        self.units = info['width'][1]
+        attrs = {}
+        for path in info['paths']:
+            attrs.update(path['attrs'])
+        geometry = PathGeometry.concat(path['geometry'] for path in info['paths'])
+        self.layers = LayerList([Layer(geometry, Style.from_attrs(attrs), info['viewBox'])])
+        self._bounds = None
+
+    @property
+    def paths(self):
+        return list(self.layers)
+
+    def bounds(self):
+        '''(xmin, ymin, width, height) covering every layer, computed once.'''
+        if self._bounds is None:
+            boxes = np.array([layer.bounds for layer in self.layers])
+            xmin, ymin = boxes[:, :2].min(axis=0)
+            xmax, ymax = (boxes[:, :2] + boxes[:, 2:]).max(axis=0)
+            self._bounds = (float(xmin), float(ymin), float(xmax - xmin), float(ymax - ymin))
+        return self._bounds
+
+    xmin = property(lambda self: self.bounds()[0])
+    ymin = property(lambda self: self.bounds()[1])
+    width = property(lambda self: self.bounds()[2])
+    height = property(lambda self: self.bounds()[3])
 
     def get_scadSVG_path_attrs(self, scadSVGpath_idx):
-        line = self.paths[scadSVGpath_idx][-1].split()
-        stroke = line[1][8:-1]
-        fill = line[2][6:-1]
-        strokewidth = float(line[3][14:-3])
-        return {
-            'stroke':stroke,
-            'fill':fill,
-            'stroke-width':strokewidth,
-            }
+        return self.paths[scadSVGpath_idx].attrs
 
-    def set_scadSVG_path_attrs(self, scadSVGpath_idx=None, stroke=None, fill=None, strokewidth=None):
-        '''Update path attributes.
+    def set_scadSVG_path_attrs(self, scadSVGpath_idx=None, stroke=None, fill=None, strokewidth=None, opacity=None):
+        '''Update path attributes of one path, or of all of them when the index is None.
         "None" or "none" is an acceptable fill.
-        TODO: Since this is updating in place, it might be better written another way.
-        TODO: If index is one, update attibute in all paths.
-        TODO: Add fill-opacity as an option.
         '''
-        path_attrs = self.get_scadSVG_path_attrs(scadSVGpath_idx)
-        stroke = path_attrs['stroke'] if stroke is None else stroke
-        fill = path_attrs['fill'] if fill is None else fill
-        strokewidth = path_attrs['stroke-width'] if strokewidth is None else strokewidth
-        self.paths[scadSVGpath_idx][-1] = f'" stroke="{stroke}" fill="{fill}" stroke-width="{strokewidth}"/>'
+        changes = {'stroke':stroke, 'fill':fill, 'stroke_width':strokewidth, 'opacity':opacity}
+        changes = {name:value for name, value in changes.items() if value is not None}
+        if changes:
+            self.restyle(None if scadSVGpath_idx is None else [scadSVGpath_idx], **changes)
+
+    def restyle(self, indices=None, **changes):
+        '''Apply Style.replace(**changes) to the paths at indices, or to every path.
+        Layers sharing a style get one shared new style, so a bulk restyle costs
+        one pass over the layers. The restyled layers replace the old ones in this
+        document only; other documents sharing them keep their style.
+        '''
+        positions = range(len(self.layers))
+        # Indexing a range checks bounds and counts negative indices from the end, as for a list.
+        selected = None if indices is None else {positions[idx] for idx in indices}
+        styles = {}
+        layers = []
+        for idx, layer in enumerate(self.layers):
+            if selected is None or idx in selected:
+                if id(layer.style) not in styles:
+                    styles[id(layer.style)] = layer.style.replace(**changes)
+                layer = Layer(layer.geometry, styles[id(layer.style)], layer.bounds)
+            layers.append(layer)
+        self.layers = LayerList(layers)
 
     def __add__(self, other):
-        xmax = max(self.xmin + self.width, other.xmin + other.width)
-        ymax = max(self.ymin + self.height, other.ymin + other.height)
-        self.xmin = min(self.xmin, other.xmin)
-        self.ymin = min(self.ymin, other.ymin)
-        self.width = xmax - self.xmin
-        self.height = ymax - self.ymin
-        self.paths += other.paths
-        return self
+        return scadSVG.from_layers(self.layers + other.layers, self.fn, self.units)
+
+    def simplified(self, tolerance=0.05, precision=None):
+        '''Smaller copy of this document for output, e.g. to a laser controller.
+        Every loop is simplified to within tolerance mm and coordinates are
+        rounded to multiples of precision mm.
+        Returns the new document and the largest deviation from the original, in mm.
+        '''
+        layers = []
+        deviation = 0.0
+        for layer in self.layers:
+            geometry, layer_deviation = simplify_geometry(layer.geometry, tolerance, precision)
+            layers.append(Layer(geometry, layer.style, layer.bounds))
+            deviation = max(deviation, layer_deviation)
+        return scadSVG.from_layers(layers, self.fn, self.units), deviation
+
+    def toolpath(self, start=None, direction=None, passes=20):
+        '''Copy of this document with every layer's loops ordered by order_loops,
+        for a laser cutter that follows the file order. Layers stay in order and
+        the head starts at start, by default the top left corner of the sheet.
+        Returns the new document and {'travel_before':..., 'travel_after':...},
+        the rapid travel in document units.
+        '''
+        if start is None:
+            start = self.bounds()[:2]
+        before = after = 0.0
+        head_before = head_after = start
+        layers = []
+        for layer in self.layers:
+            distance, head_before = travel_distance(layer.geometry, head_before) if len(layer.geometry) else (0.0, head_before)
+            before += distance
+            geometry, _ = order_loops(layer.geometry, head_after, direction, passes)
+            distance, head_after = travel_distance(geometry, head_after) if len(geometry) else (0.0, head_after)
+            after += distance
+            layers.append(Layer(geometry, layer.style, layer.bounds))
+        return scadSVG.from_layers(layers, self.fn, self.units), {'travel_before':before, 'travel_after':after}
+
+    def iter_chunks(self, dedup=False):
+        '''Yield the document piece by piece: header, one chunk per path, footer.
+        With dedup=True, regions that are rotated/translated copies of each other
+        are written once in <defs> and placed with <use>.
+        '''
+        yield svg_header(*self.bounds(), self.units)
+        for idx, layer in enumerate(self.layers):
+            yield svg_dedup_chunk(layer, f'l{idx}') if dedup else svg_path_chunk(layer)
+        yield SVG_FOOTER
+
+    def write(self, fp, dedup=False):
+        '''Stream the document to an open text file without building it in memory.'''
+        with stage('serialize', dedup=dedup) as event:
+            written = 0
+            for chunk in self.iter_chunks(dedup):
+                fp.write(chunk)
+                written += len(chunk)
+            event['svg_bytes'] = written
+            event['layers'] = len(self.layers)
 
     def __str__(self):
-        svg_lines = [
-        '<?xml version="1.0" standalone="no"?>',
-        '<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">',
-        f'<svg width="{self.width}mm" height="{self.height}mm" viewBox="{self.xmin} {self.ymin} {self.width} {self.height}" xmlns="http://www.w3.org/2000/svg" version="1.1">',
-        ]
-        for path in self.paths:
-            svg_lines += path
-        svg_lines.append('</svg>')
-        return '\n'.join(svg_lines)
+        return ''.join(self.iter_chunks())[:-1]
+
+SVG_PROLOG = (
+    '<?xml version="1.0" standalone="no"?>\n'
+    '<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+    )
+SVG_FOOTER = '</svg>\n'
+
+def svg_tag(xmin, ymin, width, height, units='mm', pad=0):
+    '''Opening <svg> tag, padded with spaces to at least pad characters.'''
+    tag = f'<svg width="{width}{units}" height="{height}{units}" viewBox="{xmin} {ymin} {width} {height}" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1"'
+    return tag.ljust(pad - 2) + '>\n'
+
+def svg_header(xmin, ymin, width, height, units='mm'):
+    return SVG_PROLOG + svg_tag(xmin, ymin, width, height, units)
 
+def svg_path_chunk(layer):
+    return f'<path d="\n{layer.geometry.to_d()}\n" {layer.style}/>\n'
+
+def svg_dedup_chunk(layer, prefix):
+    '''Layer as a <g> in which congruent regions share one <defs> path.'''
+    geometry = layer.geometry
+    classes = congruent_components(geometry)
+    if not classes:
+        return svg_path_chunk(layer)
+    defs, uses, shared = [], [], set()
+    for number, (template, members) in enumerate(classes):
+        ref = f'{prefix}s{number}'
+        defs.append(f'<path id="{ref}" d="\n{PathGeometry.from_subpaths(geometry[i] for i in template).to_d()}\n"/>\n')
+        for component, R, t in members:
+            shared.update(component)
+            matrix = ' '.join('%.9g' % v for v in (R[0, 0], R[1, 0], R[0, 1], R[1, 1], t[0], t[1]))
+            uses.append(f'<use xlink:href="#{ref}" transform="matrix({matrix})"/>\n')
+    rest = [geometry[i] for i in range(len(geometry)) if i not in shared]
+    chunk = [f'<defs>\n{"".join(defs)}</defs>\n<g {layer.style}>\n']
+    if rest:
+        chunk.append(f'<path d="\n{PathGeometry.from_subpaths(rest).to_d()}\n"/>\n')
+    chunk += uses
+    chunk.append('</g>\n')
+    return ''.join(chunk)
+
+def stream_scadSVG(fp, layers, fn=256, jobs=None, bounds=None):
+    '''Render layers concurrently and write each one to fp as soon as it and all
+    layers before it are done, so only finished-but-unwritten layers are held in memory.
+    layers is a list of (scad_obj, style) where style holds scadSVG keyword
+    arguments, e.g. {'fill':'blue'}. Layers are written in list order.
+    The document size is only known after the last render. Either give
+    bounds=(xmin, ymin, width, height) up front, or fp must be seekable:
+    a padded header is written first and filled in at the end.
+    Returns the (xmin, ymin, width, height) of the document.
+    '''
+    if bounds is None and not fp.seekable():
+        raise ValueError('stream_scadSVG needs bounds when fp is not seekable')
+    tag_width = 256
+    fp.write(SVG_PROLOG)
+    if bounds is None:
+        header_pos = fp.tell()
+        fp.write(svg_tag(0, 0, 0, 0, pad=tag_width))
+    else:
+        fp.write(svg_tag(*bounds))
+    texts = [scad_text(scad_obj, fn) for scad_obj, _ in layers]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    xmin = ymin = np.inf
+    xmax = ymax = -np.inf
+    units = 'mm'
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(scad_text2svg, text, fn) for text in texts]
+        for idx, (_, style) in enumerate(layers):
+            doc = scadSVG(None, fn, str_svg=futures[idx].result(), **style)
+            futures[idx] = None
+            doc_xmin, doc_ymin, doc_width, doc_height = doc.bounds()
+            xmin, ymin = min(xmin, doc_xmin), min(ymin, doc_ymin)
+            xmax = max(xmax, doc_xmin + doc_width)
+            ymax = max(ymax, doc_ymin + doc_height)
+            units = doc.units
+            for layer in doc.layers:
+                fp.write(svg_path_chunk(layer))
+            fp.flush()
+    fp.write(SVG_FOOTER)
+    if bounds is None:
+        bounds = (xmin, ymin, xmax - xmin, ymax - ymin)
+        end = fp.tell()
+        fp.seek(header_pos)
+        fp.write(svg_tag(*bounds, units=units, pad=tag_width))
+        fp.seek(end)
+    return bounds
 
 import solid2 as sd
 
 
 # Useful 2D functions
 
+def offset_kernel(r, kind='round', segments=None, fn=0):
+    '''Convex polygon whose Minkowski sum with a shape grows it by r.
+    'round' is OpenSCAD's circle(r) with segments sides (default: what $fn=fn
+    gives), 'miter' is square(2*r, center=True) and 'chamfer' is circle(r, $fn=4).
+    >>> offset_kernel(1, 'miter').tolist()
+    [[-1.0, -1.0], [1.0, -1.0], [1.0, 1.0], [-1.0, 1.0]]
+    '''
+    import geom2d
+    if kind == 'round':
+        return geom2d.circle_points(r, segments or geom2d.fragments(r, fn))
+    if kind == 'miter':
+        return np.array([[-r, -r], [r, -r], [r, r], [-r, r]], float)
+    if kind == 'chamfer':
+        return geom2d.circle_points(r, 4)
+    raise ValueError(f"kind must be 'round', 'miter' or 'chamfer', not {kind!r}")
+
+def offset_outline(shape, r, kind='round', segments=None, fn=0, exact=True):
+    r'''shape grown by r, the same outline as sd.minkowski()(shape, kernel)
+    for the offset_kernel(r, kind, segments, fn) kernel, but computed in-process
+    as one polygon instead of by CGAL. Circles in shape are evaluated at
+    $fn=fn; cut the shape back out with outline_polygon(shape, fn).
+    Without shapely OpenSCAD does the work: the minkowski itself, or with
+    exact=False the much faster offset(), which rounds 'round' corners with
+    differently placed vertices and equals 'miter' only for axis-aligned edges.
+    >>> sd.scad_render(offset_outline(sd.square(2), 1, 'miter'))
+    'polygon(paths = [[0, 1, 2, 3]], points = [[3.0, -1.0], [3.0, 3.0], [-1.0, 3.0], [-1.0, -1.0]]);\n'
+    '''
+    import geom2d
+    kernel = offset_kernel(r, kind, segments, fn)
+    if geom2d.shapely is not None:
+        return geom2d.to_scad(geom2d.minkowski(geom2d.evaluate(shape, fn), kernel))
+    if exact:
+        return sd.minkowski()(shape, sd.polygon(kernel.tolist()))
+    if kind == 'round':
+        return sd.offset(r=r, _fn=segments or fn or None)(shape)
+    return sd.offset(delta=r, chamfer=kind == 'chamfer')(shape)
+
+def outline_polygon(shape, fn=0):
+    '''shape as one polygon evaluated in-process at $fn=fn, the tessellation
+    offset_outline grows, or shape itself when that runs in OpenSCAD. Subtract
+    this rather than shape from an offset outline so both sides of the cut share
+    their vertices whatever $fn the model is rendered with.
+    '''
+    import geom2d
+    if geom2d.shapely is None:
+        return shape
+    return geom2d.to_scad(geom2d.evaluate(shape, fn))
+
 def halfPlane(direction, D=1000):
     r'''Create a 2D half plane. Choose D large enough to be "infinity".
     >>> sd.scad_render(halfPlane('N'))
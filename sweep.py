@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+'''Render a family of parts from one model builder and a parameter grid.
+Every combination of the grid values is built and rendered in a process
+pool, one output file per variant, plus a manifest.json recording the
+parameters, file, timings and sizes of each variant. SVG and STL renders go
+through the shared on-disk render cache, so re-running a sweep only renders
+what changed.
+
+    ./sweep.py HeartTwist.scad.py:koch_snowflake R=50 iterations=1,2,3 --format svg
+    ./sweep.py HeartTwist.scad.py:ring R=50,62 r=1.2 height=10 twist=0,15,30 slices=50 scale=.8 --fn 45
+
+A grid value is a Python literal; a tuple (1,2,3) is swept, anything else
+(including a list such as gaps=[8,7.5,7]) is a single value.
+'''
+
+import argparse
+import ast
+import concurrent.futures
+import functools
+import inspect
+import itertools
+import json
+import os
+import pathlib
+import sys
+import time
+
+import svgSCAD as svg
+
+FORMATS = {'svg':'.svg', 'scad':'.scad', 'stl':'.stl'}
+
+@functools.lru_cache(maxsize=None)
+def load_builder(builder):
+    '''Function named by 'script.py:function', imported once per process.'''
+    script, _, name = builder.rpartition(':')
+    if not script:
+        raise ValueError(f'Builder must look like script.py:function, not {builder!r}')
+    return getattr(svg.load_script(script), name)
+
+def grid_values(text):
+    '''Values to sweep for one name=value argument.
+    >>> grid_values('1,2,3'), grid_values('50'), grid_values('[8,7.5]'), grid_values('blue')
+    ([1, 2, 3], [50], [[8, 7.5]], ['blue'])
+    '''
+    try:
+        value = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return [text]
+    return list(value) if isinstance(value, tuple) else [value]
+
+def combinations(grid):
+    '''Every combination of a {name: [values]} grid, as keyword dicts.
+    >>> combinations({'R':[1, 2], 'iterations':[3]})
+    [{'R': 1, 'iterations': 3}, {'R': 2, 'iterations': 3}]
+    '''
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+def render_variant(builder, params, fn, fmt, path):
+    '''Build and render one variant to path. Runs in a worker process.
+    Returns its manifest entry; failures are recorded rather than raised.
+    '''
+    entry = {'params':params, 'fn':fn, 'file':path.name}
+    try:
+        with svg.recording() as events:
+            build = load_builder(builder)
+            if 'fn' in inspect.signature(build).parameters and 'fn' not in params:
+                # Builders that evaluate curves in-process need the render's $fn too.
+                params = {**params, 'fn':fn}
+            with svg.stage('build'):
+                scad_obj = build(**params)
+            if fmt == 'svg':
+                document = svg.scadSVG(scad_obj, fn)
+                with open(path, 'w') as fp:
+                    document.write(fp)
+            else:
+                text = svg.scad_text(scad_obj, fn)
+                path.write_text(text if fmt == 'scad' else svg.scad_text_export(text, fn, 'asciistl'))
+        entry['bytes'] = path.stat().st_size
+        entry['stages'] = svg.summarize(events)
+    except Exception as e:
+        entry['error'] = f'{type(e).__name__}: {e}'
+    return entry
+
+def sweep(builder, grid, out_dir, fn=(256,), fmt='svg', jobs=None):
+    '''Render every combination of grid (and of the fn values) with builder,
+    given as 'script.py:function', into out_dir and write out_dir/manifest.json.
+    Returns the manifest.
+    '''
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt!r}, expected one of {", ".join(FORMATS)}')
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    name = builder.rpartition(':')[2]
+    variants = [(params, f) for params in combinations(grid) for f in fn]
+    width = len(str(len(variants)))
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        futures = [
+            pool.submit(render_variant, builder, params, f, fmt, out_dir / f'{name}-{i:0{width}d}{FORMATS[fmt]}')
+            for i, (params, f) in enumerate(variants)
+            ]
+        entries = [future.result() for future in futures]
+    manifest = {
+        'builder':builder,
+        'grid':grid,
+        'fn':list(fn),
+        'format':fmt,
+        'wall':time.perf_counter() - start,
+        'variants':entries,
+        }
+    (out_dir / 'manifest.json').write_text(json.dumps(manifest, indent=1, default=str))
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('builder', help='script.py:function returning a solid2 object')
+    parser.add_argument('params', nargs='*', metavar='name=values', help='grid entry, e.g. iterations=1,2,3')
+    parser.add_argument('--fn', type=grid_values, default=[256], help='$fn values, e.g. 64,256')
+    parser.add_argument('--format', choices=list(FORMATS), help='output format (default: svg for *.svg.py scripts, scad otherwise)')
+    parser.add_argument('--out', type=pathlib.Path, help='output directory (default: sweep-<function>)')
+    parser.add_argument('--jobs', type=int, help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    grid = {}
+    for param in args.params:
+        name, sep, values = param.partition('=')
+        if not sep:
+            parser.error(f'Expected name=values, not {param!r}')
+        grid[name] = grid_values(values)
+    script, _, name = args.builder.rpartition(':')
+    fmt = args.format or ('svg' if script.endswith('.svg.py') else 'scad')
+    out_dir = args.out or pathlib.Path(f'sweep-{name}')
+
+    manifest = sweep(args.builder, grid, out_dir, args.fn, fmt, args.jobs)
+    failed = [entry for entry in manifest['variants'] if 'error' in entry]
+    for entry in manifest['variants']:
+        status = entry.get('error') or f'{entry["bytes"]} bytes'
+        print(f'{entry["file"]}  {entry["params"]}  fn={entry["fn"]}  {status}')
+    print(f'{len(manifest["variants"])} variants in {manifest["wall"]:.1f}s, manifest in {out_dir / "manifest.json"}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())